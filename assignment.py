@@ -1,90 +1,39 @@
-import pygame
-from PIL import Image
 import time
-import pandas as pd
 import os
-import re # For string slicing stuff (used in natural sort function)
-import difflib # For string matching in keywords for keyword suggestions and matching
+from catalog import CatalogWatcher, get_catalog # Shared canteen catalog, loaded once per process
+from instrumentation import timed # Stage timers, off unless CANTEEN_INSTRUMENT is set
+from keyword_query import QuerySyntaxError, is_boolean_query, parse_keyword_query, query_terms # Boolean keyword queries
+from query_engine import natural_sort, query_combined, query_keyword, query_price, query_nearest, query_walking, walking_route # Non-interactive search functions
 
 # Center any windows opened (the map, for example)
 os.environ['SDL_VIDEO_CENTERED'] = '1'
 
 # Load dataset for keyword dictionary
+# The dataset is only read once per process, every loader is served from the same shared catalog
+@timed("load_stall_keywords")
 def load_stall_keywords(data_location="canteens.xlsx"):
-    # Get list of canteens and stalls
-    canteen_data = pd.read_excel(data_location, trim_ws=True)
-    canteens = canteen_data['Canteen'].unique()
-    canteens = sorted(canteens, key=str.lower)
-
-    stalls = canteen_data['Stall'].unique()
-    stalls = sorted(stalls, key=str.lower)
-
-    keywords = {}
-    for canteen in canteens:
-        keywords[canteen] = {}
-
-    copy = canteen_data.copy()
-    copy.drop_duplicates(subset="Stall", inplace=True)
-    stall_keywords_intermediate = copy.set_index('Stall')['Keywords'].to_dict()
-    stall_canteen_intermediate = copy.set_index('Stall')['Canteen'].to_dict()
-
-    for stall in stalls:
-        stall_keywords = stall_keywords_intermediate[stall]
-        stall_canteen = stall_canteen_intermediate[stall]
-        keywords[stall_canteen][stall] = stall_keywords
-
-    return keywords
+    return get_catalog(data_location).stall_keywords()
 
 
 # Load dataset for price dictionary
+@timed("load_stall_prices")
 def load_stall_prices(data_location="canteens.xlsx"):
-    # Get list of canteens and stalls
-    canteen_data = pd.read_excel(data_location, trim_ws=True)
-    canteens = canteen_data['Canteen'].unique()
-    canteens = sorted(canteens, key=str.lower)
-
-    stalls = canteen_data['Stall'].unique()
-    stalls = sorted(stalls, key=str.lower)
-
-    prices = {}
-    for canteen in canteens:
-        prices[canteen] = {}
-
-    copy = canteen_data.copy()
-    copy.drop_duplicates(subset="Stall", inplace=True)
-    stall_prices_intermediate = copy.set_index('Stall')['Price'].to_dict()
-    stall_canteen_intermediate = copy.set_index('Stall')['Canteen'].to_dict()
-
-    for stall in stalls:
-        stall_price = stall_prices_intermediate[stall]
-        stall_canteen = stall_canteen_intermediate[stall]
-        prices[stall_canteen][stall] = stall_price
-
-    return prices
+    return get_catalog(data_location).stall_prices()
 
 
 # Load dataset for location dictionary
+@timed("load_canteen_location")
 def load_canteen_location(data_location="canteens.xlsx"):
-    # Get list of canteens
-    canteen_data = pd.read_excel(data_location, trim_ws=True)
-    canteens = canteen_data['Canteen'].unique()
-    canteens = sorted(canteens, key=str.lower)
-
-    # Get dictionary of {canteen:[x,y]}
-    canteen_locations = {}
-    for canteen in canteens:
-        copy = canteen_data.copy()
-        copy.drop_duplicates(subset="Canteen", inplace=True)
-        canteen_locations_intermediate = copy.set_index('Canteen')['Location'].to_dict()
-    for canteen in canteens:
-        canteen_locations[canteen] = [int(canteen_locations_intermediate[canteen].split(',')[0]),
-                                      int(canteen_locations_intermediate[canteen].split(',')[1])]
-
-    return canteen_locations
+    return get_catalog(data_location).canteen_locations()
 
 
 # Get user's location with the use of PyGame
 def get_user_location_interface():
+    # pygame (and NumPy under it) is slow to import, so only the map windows pay for it, not the text menu and searches
+    import pygame
+    from map_assets import load_image # Decoded and scaled map images, shared by the map windows
+    from map_tiles import MapView, open_pyramid # Zoomable campus map
+
     # Initialize pygame
     pygame.init()
     
@@ -101,26 +50,35 @@ def get_user_location_interface():
     # Set title of screen
     pygame.display.set_caption(screenTitle)
 
-    # Open image file and pin file, and scale them to the desired size
-    ntuMapOriginal = pygame.image.load(imageLocation).convert()
-    ntuMap = pygame.transform.smoothscale(ntuMapOriginal, mapSize)
-    pinOriginal = pygame.image.load(pinLocation).convert_alpha()
-    pin = pygame.transform.smoothscale(pinOriginal, pinSize)
+    # Open pin file, scaled to the desired size (decoded and scaled only once, then reused)
+    pin = load_image(pinLocation, pinSize, alpha=True)
+
+    # The map is shown through a view of its tile pyramid, which can be zoomed into and panned around
+    view = MapView(open_pyramid(imageLocation, mapSize), mapSize)
+    if len(view.pyramid.levels) > 1:
+        pygame.display.set_caption(screenTitle + " - scroll to zoom, right-drag to pan")
+
+    # The window is only drawn again when it needs to be (the view moved, or the window was uncovered),
+    # and placing the pin only updates the part of the window under the pin.
+    redraw = True
 
     # Loop for the whole interface while it remains active
     exit = False
     userLocation = None
     while not exit:
-        # First, we make a call to the event queue to check for events every frame
-        for event in pygame.event.get():
+        if redraw:
+            view.draw(screen)
+            pygame.display.flip()
+            redraw = False
+
+        # Sleep until the next event instead of refreshing the window nonstop, so an idle window uses no CPU.
+        # Events that queued up in the meantime (e.g. mouse moves while dragging the map) are handled together, with one redraw.
+        for event in [pygame.event.wait()] + pygame.event.get():
             # User exits the window, we return an error as location was not selected
             if event.type == pygame.QUIT:
                 exit = True
                 userLocation = None
-
-            # DISPLAY ELEMENTS
-            # If the window is not closed, then we show NTU map and let the user pick a location
-            screen.blit(ntuMap, (0,0))
+                break
 
             # Do NOT allow resizing of window
             """ # If the user resizes the window, resize accordingly
@@ -130,22 +88,21 @@ def get_user_location_interface():
                 scaledHeight = event.dict['h']
                 scaledWidth = event.dict['w'] """
 
-            # If the user picks a coordinate, then we close the window and return the coordinates of the click
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                # Get outputs of Mouseclick event handler
-                (mouseX, mouseY) = pygame.mouse.get_pos()
+            # Zooming and panning, or the window was uncovered or restored, so draw the map again
+            if view.handle_event(event) or event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                redraw = True
 
-                # Update userLocation. Since we have successfully captured the user input, there are no more errors.
-                userLocation = (mouseX, mouseY)
+            # If the user picks a coordinate (left click), then we close the window and return the coordinates of the click
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                # Update userLocation (in map coordinates, whatever the zoom). Since we have successfully captured the user input, there are no more errors.
+                userLocation = view.to_map(event.pos)
 
                 # Paste pin on mouse position
-                screen.blit(pin, (userLocation[0] - 25, userLocation[1] - 42))
-                pygame.display.update()
+                pinArea = screen.blit(pin, (event.pos[0] - 25, event.pos[1] - 42))
+                pygame.display.update(pinArea)
                 time.sleep(0.2)
                 exit = True
-                
-        # While window is open, constantly refresh the window display
-        pygame.display.update()
+                break
 
     pygame.display.quit()
     pygame.quit()
@@ -154,40 +111,16 @@ def get_user_location_interface():
 
 # Keyword-based Search Function
 # This function attempts to match the search term with the keywords of various stalls
+# The search itself is done by query_keyword, this function only displays the results and talks to the user
 def search_by_keyword(keyword):
-    # Since keyword is non-case sensitive, we standardize it to small letters
-    searchTerm = keyword.lower()
-
-    # Load list of stalls and their keywords (dictionary within dictionary)
-    stallList = load_stall_keywords()
-
-    # Create an empty dictionary to store results found
-    results = {}
-    numberOfStallsFound = 0
-
-    # Search all the stall keywords within the canteens to find matches KEY : VALUE = CANTEEN NAME : DICTIONARY OF STALLS
-    # In other words, canteen = Canteen name, stalls = Dictionary of stalls
     print("Searching...")
-    for canteen, stalls in stallList.items():
-        # List of stalls found in this canteen
-        stallsFound = []
-
-        # KEY : VALUE = STALL NAME : KEYWORDS OF STALL (As a string)
-        # i.e. stall = Stall name, keywords = Keywords of stall as a string e.g. "Halal, Chinese"
-        for stall, keywords in stalls.items(): 
-            # If our search term matches a keyword of a stall, we add the stall to results
-            if (searchTerm in keywords.lower()) or (keywords.lower() in searchTerm):
-                numberOfStallsFound += 1
-                # Add that stall found and its keywords as a concantated string to a list of found stalls within this canteen
-                stallsFound.append(stall + " (" + keywords + ")")
-        # Add the stalls we found in this canteen to a results dictionary contained all the canteens with stalls found by the search term
-        if (len(stallsFound) > 0):
-            results[canteen] = stallsFound
+    result = query_keyword(keyword)
+    searchTerm = result.searchTerm
 
     # Display results
-    if (numberOfStallsFound <= 0):
+    if (len(result.stalls) <= 0):
         # If no food stalls found, we suggest keywords closest to the keyword of the user to get a match
-        suggestion = suggest_keyword(searchTerm)
+        suggestion = result.suggestion
         if (suggestion != None):
             # If the user agrees with the suggestion, we search again with the new valid keyword
             validated = False
@@ -205,88 +138,56 @@ def search_by_keyword(keyword):
                     print("Please input 'y' to search with the suggested keyword, or 'n' to exit to the menu.")
         else:
             print("No food stalls(s) found with input keyword '{}'. No keyword suggestions match your search term. Exiting to menu...".format(searchTerm))
-       
-        
-    else:
-        print("{} food stall(s) found matching keyword '{}':".format(numberOfStallsFound, searchTerm))
 
-        # Sort the dictionary's keys to print canteen names in sorted order
-        sortedCanteens = natural_sort(results.keys())
+    else:
+        print("{} food stall(s) found matching keyword '{}':".format(len(result.stalls), searchTerm))
 
-        # Using the sorted keys, we then access the results dictionary to print out our results in order.
-        for canteenName in sortedCanteens:
-            # Iterate through the list of stalls found within this particular canteen that matches the search term
-            for stallFound in results[canteenName]: 
-                print(canteenName + " - " + stallFound)
+        # Stalls are already listed by canteen (in natural order), then by stall name
+        for match in result.stalls:
+            print("{} - {} ({})".format(match.canteen, match.stall, match.keywords))
 
 # Price-based Search Function
 # Returns a listing of stalls that fit within a given price range
+# The search itself is done by query_price, this function only displays the results
 def search_by_price(minPrice, maxPrice):
-    # Load list of stalls and their keywords (dictionary within dictionary)
-    priceList = load_stall_prices()
-
-    # Create an empty dictionary to store results found
-    results = {}
-    numberOfStallsFound = 0
-
-    # Search all the canteens to find stalls within the price range KEY : VALUE = CANTEEN NAME : DICTIONARY OF STALLS
-    # In other words, canteen = Canteen name, stalls = Dictionary of stalls
     print("Searching...")
-    for canteen, stalls in priceList.items():
-        # List of stalls found in this canteen
-        stallsFound = {}
-
-        # KEY : VALUE = STALL NAME : KEYWORDS OF STALL (As a string)
-        # i.e. stall = Stall name, keywords = Keywords of stall as a string e.g. "Halal, Chinese"
-        for stall, price in stalls.items():
-            # If price range is within the search range, we add it to the results
-            if (price >= minPrice and price <= maxPrice):
-                numberOfStallsFound += 1
-                stallsFound[stall] = price
-        
-        # Store into results under canteen name
-        if (len(stallsFound) > 0):
-            results[canteen] = stallsFound
+    result = query_price(minPrice, maxPrice)
 
     # Display results
-    if (numberOfStallsFound <= 0):
+    if (len(result.stalls) <= 0):
         print("No food stall(s) found within specified price range.")
     else:
-        print("{} food stall(s) found within specified price range (S${:.2f} - S${:.2f}):".format(numberOfStallsFound, minPrice, maxPrice))
-
-        # Sort the dictionary's keys to print canteen names in sorted order
-        sortedCanteens = natural_sort(results.keys())
+        print("{} food stall(s) found within specified price range (S${:.2f} - S${:.2f}):".format(len(result.stalls), minPrice, maxPrice))
 
-        # Using the sorted keys, we then access the results dictionary to print out our results in order.
-        for canteenName in sortedCanteens:
-            # Iterate through the dictionary of stalls found within this particular canteen that matches the price range
-            for stall, price in results[canteenName].items(): 
-                print("{} ({}) - S${:.2f}".format(stall, canteenName, price))
+        # Stalls are already listed by canteen (in natural order), then by stall name
+        for match in result.stalls:
+            print("{} ({}) - S${:.2f}".format(match.stall, match.canteen, match.price))
 
 # Location-based Search Function
+# The search itself is done by query_nearest, this function only displays the results and offers to show them on the map
+# If a path graph of the campus was given (see path_graph.py), canteens are ranked by walking distance along the paths instead
 def search_nearest_canteens(userLocation, numOfCanteens):
-    # Load a list of all the canteen locations KEY: Canteen name VALUE: List[0] = Canteen x location, List[1] = Canteen y location
-    locationList = load_canteen_location()
-    
-    # Create a dictionary to store distance of the canteen from the user
-    results = {}
-
-    # Iterate through and calculate distance of each canteen from the user
     print("Searching...")
-    for canteen, coordinates in locationList.items():
-        # Pythagoras theorem, x values are index 0, y values are index 1
-        distanceFromUser = ((userLocation[0] - coordinates[0])**2 + (userLocation[1] - coordinates[1])**2)**(1/2)
-        results[canteen] = distanceFromUser
-    
-    # Sort the results based on distance
-    # We call the sorted function on the list of tuples (canteen, distance), and set the sorting key to be the second item in the tuple
-    # sortedResults is a sorted list of tuples (canteen, distance) sorted by distance from the user
-    sortedResults = sorted(results.items(), key = lambda distance: distance[1])
+    try:
+        result = query_walking(userLocation, numOfCanteens)
+    except ValueError as error:
+        # A broken path graph file should not stop the search, we fall back to straight-line distances
+        print("Could not read the campus paths, using straight-line distances instead. ({})".format(error))
+        result = None
+    routes = None
+    if result is None:
+        result = query_nearest(userLocation, numOfCanteens)
+    else:
+        print("Distances are walking distances along the campus paths.")
+        routes = {found.canteen: walking_route(userLocation, found.canteen) for found in result.canteens}
+
+    # sortedResults is a list of tuples (canteen, distance) sorted by distance from the user
+    sortedResults = [(found.canteen, found.distance) for found in result.canteens]
 
     # Display results
-    print("{} nearest canteen(s) found:".format(numOfCanteens))
-    for i in range(numOfCanteens):
-        print("{} - {}m".format(sortedResults[i][0], int(sortedResults[i][1])))
+    print("{} nearest canteen(s) found:".format(len(sortedResults)))
+    for canteen, distance in sortedResults:
+        print("{} - {}m".format(canteen, int(distance)))
     
     # We let the user choose if he/she wants to view results on a map or not
     validated = False
@@ -295,7 +196,7 @@ def search_nearest_canteens(userLocation, numOfCanteens):
         if (errorCheck == "y" or errorCheck == "Y"):
             # Call function to display nearest canteens on the map
             validated = True
-            show_nearest_canteens(userLocation, sortedResults[0:numOfCanteens])
+            show_nearest_canteens(userLocation, sortedResults, routes)
         elif (errorCheck == "n" or errorCheck == "N"):
             validated = True
             print("Alright. Hope you enjoy the food in NTU!")
@@ -304,14 +205,41 @@ def search_nearest_canteens(userLocation, numOfCanteens):
             print("Please input 'y' to view the {} nearest canteens around you on the map, or 'n' to exit to the menu.".format(numOfCanteens))
     return()
 
+# Combined Search Function
+# Finds stalls matching any mix of a keyword, a price range and the user's location, e.g. halal food under S$5 within 300m
+# The search itself (and the order its filters are applied in) is done by query_combined, this function only displays the results
+def search_combined(keyword, minPrice, maxPrice, userLocation, numOfCanteens, radius):
+    print("Searching...")
+    result = query_combined(keyword, minPrice, maxPrice, userLocation, numOfCanteens, radius)
+    print("Search plan: {}".format(" -> ".join(result.plan)))
+
+    # Display results
+    if (len(result.stalls) <= 0):
+        print("No food stall(s) found matching all of your criteria.")
+    else:
+        print("{} food stall(s) found matching all of your criteria:".format(len(result.stalls)))
+
+        # Stalls are already ranked, nearest canteen first if a location was given, cheapest first otherwise
+        for match in result.stalls:
+            if match.distance is None:
+                print("{} ({}) - S${:.2f} ({})".format(match.stall, match.canteen, match.price, match.keywords))
+            else:
+                print("{} ({}, {}m) - S${:.2f} ({})".format(match.stall, match.canteen, int(match.distance), match.price, match.keywords))
+
 # ===== Any additional function to assist search criteria ===== #
 
 # Validates the validity of a given keyword (one word, string etc.) and returns True if valid, False if not
+# Several keywords can be combined into a boolean query, e.g. halal AND noodles NOT spicy (see keyword_query.py)
 # This function assumes that stall names can have weird things like symbols and numbers
 def validate_keyword(keyword):
     try:
-        # If more than one word, raise a value error
-        if (len(keyword.split()) != 1 or len(keyword) < 2):
+        # More than one word must make up a valid boolean query, every keyword in it at least two letters long
+        if is_boolean_query(keyword):
+            if any(len(term) < 2 for term in query_terms(parse_keyword_query(keyword))):
+                raise ValueError
+            return(True)
+        # If a single keyword is too short, raise a value error
+        if (len(keyword) < 2):
             raise ValueError
         # Otherwise, we validate the input to be true
         else:
@@ -320,8 +248,11 @@ def validate_keyword(keyword):
     except TypeError:
         print("Kindly ensure that the keyword is a string. Please try again.")
         return(False)
+    except QuerySyntaxError as error:
+        print("{} Combine keywords with AND, OR and NOT, e.g. halal AND noodles NOT spicy. Please try again.".format(error))
+        return(False)
     except ValueError:
-        print("Only a single keyword search term is allowed, and the keyword must be at least two letters. Please try again.")
+        print("Each keyword must be at least two letters. Please try again.")
         return(False)
     except:
         print("An unexpected error has occured. Please contact the engineer for help.")
@@ -329,29 +260,28 @@ def validate_keyword(keyword):
 
 # Loads the list of keywords from the data list and removes duplicates
 def load_suggestions():
-    keywordsList = load_stall_keywords()
-    noDuplicatedKeywordsList = []
-    for stall in keywordsList.values():
-        for keywords in stall.values():
-            # Get a list of the keywords of each stall, remove spaces from each word and split by commas
-            keywords = keywords.split(",")
-            for keyword in keywords:
-                if keyword[0] == " ":
-                    keyword = keyword[1:]
-                if keyword not in noDuplicatedKeywordsList:
-                    noDuplicatedKeywordsList.append(keyword)
-    return(noDuplicatedKeywordsList)
+    return get_catalog().suggestionIndex.keywords()
 
 # This function takes in a search term (keyword) and matches it against valid and searchable keywords to find a similarity.
 # It then returns the most similar term as a suggestion.
+# The suggestion index is built once with the catalog, so a typo does not cost a pass over the whole vocabulary.
 def suggest_keyword(searchTerm):
-    validKeywords = load_suggestions()
-    suggestion = difflib.get_close_matches(searchTerm, validKeywords, n = 1, cutoff = 0.5)
+    suggestion = get_catalog().suggestionIndex.suggest(searchTerm, n = 1, cutoff = 0.5)
     if len(suggestion) >= 1:
         return(suggestion[0])
     else:
         return(None)
 
+# Prints the keywords starting with the given prefix, the keywords hitting the most stalls first
+def show_keyword_completions(prefix, numOfCompletions = 5):
+    completions = get_catalog().autocompleteIndex.complete(prefix.strip(), numOfCompletions, kinds = ["keyword"])
+    if len(completions) <= 0:
+        print("No keywords start with '{}'. Please try again.".format(prefix.strip()))
+    else:
+        print("Keywords starting with '{}':".format(prefix.strip()))
+        for keyword, kind, numOfStalls in completions:
+            print("{} ({} stall(s))".format(keyword.lower(), numOfStalls))
+
 # This function validates if the prices input are correct and returns the corrected price input if any. Else, return false.
 def validate_price(minPrice, maxPrice):
     try:
@@ -417,7 +347,7 @@ def validate_nearest_number(numOfCanteens):
     try:
         # If not a singular integer, raise a value error
         numOfCanteens = int(numOfCanteens)
-        maxNumOfCanteens = 15 # Maximum number of canteens in NTU. If input is above this number, we default to it.
+        maxNumOfCanteens = len(get_catalog().canteens) # Number of canteens in our data. If input is above this number, we default to it.
         if (numOfCanteens == 0):
             raise ValueError    
         # If input is -ve, we default to 1. Else we just return the value.
@@ -426,8 +356,8 @@ def validate_nearest_number(numOfCanteens):
             return(1)
         # More than the number of canteens in NTU
         elif (numOfCanteens > maxNumOfCanteens):
-            print("Woops. That's more than the number of canteens in NTU! Showing you ALL our canteens instead!")
-            return(15)
+            print("Woops. That's more than the number of canteens we know of! Showing you ALL our canteens instead!")
+            return(maxNumOfCanteens)
         else:
             return(numOfCanteens)
     # Error handling statements, we return false for this function to be used in other functions
@@ -441,8 +371,32 @@ def validate_nearest_number(numOfCanteens):
         print("An unexpected error has occured. Please contact the engineer for help.")
         return(False)
 
+# This function validates a search radius around the user. Returns the radius if valid, else it returns False
+def validate_radius(radius):
+    try:
+        radius = float(radius)
+        # A radius must be a positive number (NaN is not)
+        if not (radius >= 0):
+            raise ValueError
+        return(radius)
+    # Error handling statements, we return false for this function to be used in other functions
+    except (TypeError, ValueError):
+        print("The search radius must be a positive number of metres. Please try again.")
+        return(False)
+    except:
+        print("An unexpected error has occured. Please contact the engineer for help.")
+        return(False)
+
 # Displays the nearest canteens around the user using pygame
-def show_nearest_canteens(userLocation, results):
+# routes optionally maps canteens to the walk there, as a list of (x, y) points drawn as a line on the map
+def show_nearest_canteens(userLocation, results, routes=None):
+    # pygame (and NumPy under it) is slow to import, so only the map windows pay for it, not the text menu and searches
+    import pygame
+    from map_assets import load_image # Decoded and scaled map images, shared by the map windows
+    from map_render import draw_results, render_labels # Pins and labels of the results map, shared with the PNG renderer
+    from map_tiles import MapView, open_pyramid # Zoomable campus map
+    from nearest_raster import COVERAGE_COLOURS # Colours of the canteen coverage overlay
+
     # Initialize pygame
     pygame.init()
     pygame.font.init()
@@ -457,8 +411,7 @@ def show_nearest_canteens(userLocation, results):
 
     # Text variables
     font = pygame.font.SysFont("Arial", 10)
-    white = (255, 255, 255) 
-    black = (0, 0, 0)
+    routeColour = (0, 102, 204)
 
     # Set screen width and height for display surface
     screen = pygame.display.set_mode(mapSize)
@@ -466,77 +419,74 @@ def show_nearest_canteens(userLocation, results):
     # Set title of screen
     pygame.display.set_caption(screenTitle)
 
-    # Open image file and pin file, and scale them to the desired size
-    ntuMapOriginal = pygame.image.load(imageLocation).convert()
-    ntuMap = pygame.transform.smoothscale(ntuMapOriginal, mapSize)
-    pinOriginal = pygame.image.load(pinLocation).convert_alpha()
-    pin = pygame.transform.smoothscale(pinOriginal, pinSize)
-    foodPinOriginal = pygame.image.load(foodPinLocation).convert_alpha()
-    foodPin = pygame.transform.smoothscale(foodPinOriginal, pinSize)
+    # Open pin files, scaled to the desired size (decoded and scaled only once, then reused)
+    pin = load_image(pinLocation, pinSize, alpha=True)
+    foodPin = load_image(foodPinLocation, pinSize, alpha=True)
+
+    # The map is shown through a view of its tile pyramid, which can be zoomed into and panned around
+    view = MapView(open_pyramid(imageLocation, mapSize), mapSize)
+    controls = ["scroll to zoom, right-drag to pan"] if len(view.pyramid.levels) > 1 else []
 
     # Load the stall location data to show on the map
     locationList = load_canteen_location()
 
+    # Coverage overlay tinting each pixel with the colour of its nearest canteen, toggled with the C key.
+    # It is only available once the nearest canteen raster has been generated (python nearest_raster.py).
+    raster = get_catalog().nearestRaster
+    coverage = None
+    showCoverage = False
+    if raster is not None and (raster.width, raster.height) == mapSize:
+        coverage = pygame.image.frombuffer(raster.coverage_rgba(COVERAGE_COLOURS), mapSize, "RGBA").convert_alpha()
+        controls.append("press C to show canteen coverage")
+    if controls:
+        pygame.display.set_caption(screenTitle + " - " + ", ".join(controls))
+
+    # The labels are rendered once up front, and the window is only drawn again when it needs to be
+    # (the view moved, the overlay was toggled, or the window was uncovered)
+    labels = render_labels(font, results)
+    redraw = True
+
     # Loop for the whole interface while it remains active
     exit = False
     while not exit:
-        # First, we make a call to the event queue to check for events every frame
-        for event in pygame.event.get():
+        if redraw:
+            # DISPLAY ELEMENTS (Map background, coverage overlay, walking routes, user location pin, nearest canteens pins)
+            view.draw(screen)
+            if showCoverage:
+                view.draw_overlay(screen, coverage)
+            draw_results(screen, pin, foodPin, labels, userLocation, results, locationList, routes, routeColour, view.to_screen)
+            pygame.display.flip()
+            redraw = False
+
+        # Sleep until the next event instead of refreshing the window nonstop, so an idle window uses no CPU.
+        # Events that queued up in the meantime (e.g. mouse moves while dragging the map) are handled together, with one redraw.
+        for event in [pygame.event.wait()] + pygame.event.get():
             # User exits the window, we return an error as location was not selected
             if event.type == pygame.QUIT:
                 exit = True
+                break
 
-            # DISPLAY ELEMENTS (Map background, user location pin, nearest canteens pins)
-            screen.blit(ntuMap, (0,0))
-            screen.blit(pin, (userLocation[0] - 25, userLocation[1] - 42))
-
-            # Display canteen pins first, then overlay text on top
-            for canteen in results:
-                canteenName = canteen[0]
-                xLocation = locationList[canteenName][0]
-                yLocation = locationList[canteenName][1]
-
-                # Put canteen pin onto the display screen
-                screen.blit(foodPin, (xLocation - 25, yLocation - 50))
-
-            # Text display
-            for canteen in results:
-                canteenName = canteen[0]
-                distance = canteen[1]
-                xLocation = locationList[canteenName][0]
-                yLocation = locationList[canteenName][1]
-
-                # Add text for canteen name
-                canteenText = font.render(" {} ({}m)".format(canteenName, int(distance)), True, white, black)
-                textWidth = pygame.Surface.get_width(canteenText)
-                screen.blit(canteenText, ((xLocation - textWidth // 2), yLocation - 20))
-                
-        # While window is open, constantly refresh the window display
-        pygame.display.update()
+            # The C key shows or hides the coverage overlay
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_c and coverage is not None:
+                showCoverage = not showCoverage
+                redraw = True
+
+            # Zooming and panning, or the window was uncovered or restored, so draw it again
+            if view.handle_event(event) or event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                redraw = True
 
     pygame.display.quit()
     pygame.quit()
 
-# This function sorts a list of strings/numbers no matter if a number is in a string or not
-# E.g. elm0, elm11, elm2, elm55 => elm0, elm2, elm11, elm55
-def natural_sort(unsortedList):
-    # Lambda transforms all given inputs based on the instructions given and returns it as a result
-    # convert transforms any given inputs into an integer if the input is a digit. If not, it transforms the string into lowercase.
-    convert = lambda text: int(text) if text.isdigit() else text.lower() 
-    # alphanumKey splits given inputs into strings and numbers (e.g. "a23b" => ["a", "23", "b'"])
-    # It then converts each item in the list using the convert lambda above
-    alphanumKey = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ]
-    # We then sort any given list input using alphanumKey as the key for sorting
-    # Since alphanumKey is a list of letters and numbers, the sorted functions is able to compare integer > interger and string > string
-    # Therefore, it can sort numbers within strings and return a naturally sorted result. 
-    return sorted(unsortedList, key = alphanumKey)
-
 # Main Python Program Template
 
 # Main Program Function
 def main():
     loop = True
 
+    # Reload canteens.xlsx in the background whenever it is edited, so changes show up without restarting the program
+    CatalogWatcher("canteens.xlsx").start()
+
     while loop:
         try:    
             print("=======================")
@@ -545,9 +495,10 @@ def main():
             print("2 -- Keyword-based Search")
             print("3 -- Price-based Search")
             print("4 -- Location-based Search")
-            print("5 -- Exit Program")
+            print("5 -- Combined Search")
+            print("6 -- Exit Program")
             print("=======================")
-            option = int(input("Please enter option [1-5]: "))
+            option = int(input("Please enter option [1-6]: "))
 
             if option == 1:
                 # Print provided dictionary data structures
@@ -588,11 +539,17 @@ def main():
             elif option == 2:
                 # keyword-based search
                 print("Keyword-based Search")
+                print("Tip: end your input with '?' to see matching keywords, e.g. 'chi?'")
+                print("Tip: combine keywords with AND, OR, NOT and \"quoted phrases\", e.g. halal AND noodles NOT spicy")
                 searchTerm = ""
                 validated = False
-                # Attempt to validate keyword (one word string only, symbols are allowed) While not validated, keep asking for new keyword
+                # Attempt to validate keyword (one word, or a boolean query of several, symbols are allowed) While not validated, keep asking for new keyword
                 while not (validated):
                     searchTerm = input("Enter type of food: ")
+                    # The user asked for completions of what they typed so far, we show them and ask again
+                    if searchTerm.endswith("?"):
+                        show_keyword_completions(searchTerm[:-1])
+                        continue
                     validated = validate_keyword(searchTerm)
                 search_by_keyword(searchTerm)
     
@@ -635,6 +592,72 @@ def main():
                 search_nearest_canteens(userLocation, validatedNum)
 
             elif option == 5:
+                # Combined search, every criterion is optional but at least one must be given
+                print("Combined Search")
+                print("Leave a field blank to skip it.")
+                keyword = None
+                minPrice = maxPrice = None
+                userLocation = numOfCanteens = radius = None
+
+                validated = False
+                while not (validated):
+                    searchTerm = input("Enter type of food: ")
+                    if searchTerm.endswith("?"):
+                        show_keyword_completions(searchTerm[:-1])
+                        continue
+                    validated = searchTerm.strip() == "" or validate_keyword(searchTerm)
+                if searchTerm.strip() != "":
+                    keyword = searchTerm
+
+                validatedPrice = False
+                while (validatedPrice == False):
+                    minPriceInput = input("Enter minimum price: ").strip()
+                    maxPriceInput = input("Enter maximum price: ").strip()
+                    if minPriceInput == "" and maxPriceInput == "":
+                        break
+                    # A missing end of the range is left open
+                    validatedPrice = validate_price(minPriceInput or "0", maxPriceInput or "inf")
+                if validatedPrice:
+                    minPrice, maxPrice = validatedPrice[0], None if validatedPrice[1] == float("inf") else validatedPrice[1]
+
+                validated = False
+                while not validated:
+                    errorCheck = input("Search around your location on the map? (y/n): ")
+                    if (errorCheck == "y" or errorCheck == "Y"):
+                        validated = True
+                        print("Please select your current location on the map.")
+                        userLocation = get_user_location_interface()
+                        if userLocation is None:
+                            print("You did not select your current location. Searching without it...")
+                    elif (errorCheck == "n" or errorCheck == "N"):
+                        validated = True
+                    else:
+                        print("Please input 'y' to select your location on the map, or 'n' to search without it.")
+
+                if userLocation is not None:
+                    print("Your location is entered at (x,y): {}, {}".format(int(userLocation[0]), int(userLocation[1])))
+                    validatedNum = False
+                    while (validatedNum == False):
+                        numOfCanteensInput = input("Please enter the number of canteens to search for around you: ").strip()
+                        if numOfCanteensInput == "":
+                            break
+                        validatedNum = validate_nearest_number(numOfCanteensInput)
+                    numOfCanteens = validatedNum or None
+                    validatedRadius = False
+                    while (validatedRadius is False):
+                        radiusInput = input("Please enter the search radius in metres: ").strip()
+                        if radiusInput == "":
+                            break
+                        validatedRadius = validate_radius(radiusInput)
+                    radius = None if validatedRadius is False else validatedRadius
+
+                if keyword is None and minPrice is None and maxPrice is None and userLocation is None:
+                    print("No search criteria given. Exiting to menu...")
+                    continue
+                # call combined search function
+                search_combined(keyword, minPrice, maxPrice, userLocation, numOfCanteens, radius)
+
+            elif option == 6:
                 # exit the program
                 print("Exiting F&B Recommendation")
                 loop = False
@@ -642,11 +665,12 @@ def main():
             else:
                 raise ValueError
         except ValueError:
-            print("Please input a number from 1-5 only. Please try again.")
+            print("Please input a number from 1-6 only. Please try again.")
         except TypeError:
-            print("Only numbers from 1-5 are allowed for menu selection. Please try again.")
+            print("Only numbers from 1-6 are allowed for menu selection. Please try again.")
         except:
             print("An unidentified error occured. Please contact the engineers for help.")
 
-# Run main program            
-main()
\ No newline at end of file
+# Run main program
+if __name__ == "__main__":
+    main()
\ No newline at end of file
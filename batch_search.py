@@ -0,0 +1,97 @@
+import argparse
+import json
+import sys
+import time
+from itertools import islice
+from multiprocessing import Pool
+
+from catalog import get_catalog
+import instrumentation
+from query_engine import result_as_dict, run_query
+
+# Batch query mode: reads one JSON query per line and writes one JSON result per line, in the same order.
+# Each line of output is {"result": ...} or {"error": ...}, plus the query's "id" if it had one.
+#   python batch_search.py < queries.jsonl > results.jsonl
+#   python batch_search.py --workers 4 < queries.jsonl > results.jsonl
+#   python batch_search.py --instrument stages.jsonl < queries.jsonl > results.jsonl   (time every stage, see instrumentation.py)
+
+# Dataset used by this process (set once per worker, so the catalog and its indexes are only loaded once)
+_dataLocation = "canteens.xlsx"
+
+
+# Loads the catalog for this process, run once when a worker starts
+def init_worker(data_location):
+    global _dataLocation
+    _dataLocation = data_location
+    get_catalog(data_location)
+
+
+# Answers one line of JSONL input and returns the line of JSON output (without the newline).
+# Whatever goes wrong with one query is reported on its own line, so it cannot end the rest of the batch.
+def answer_line(line):
+    try:
+        query = json.loads(line)
+    except (ValueError, RecursionError):
+        return json.dumps({"error": "Line is not valid JSON"})
+
+    answer = {}
+    if isinstance(query, dict) and "id" in query:
+        answer["id"] = query["id"]
+    try:
+        answer["result"] = result_as_dict(run_query(query, get_catalog(_dataLocation)))
+    except ValueError as error:
+        answer["error"] = str(error)
+    except Exception as error:
+        answer["error"] = "Internal error: {}: {}".format(type(error).__name__, error)
+    return json.dumps(answer)
+
+
+# Streams queries from input to output. Lines are read in windows of windowSize, so memory stays bounded however long
+# the input is, and each window is answered in order (spread over the pool's workers if there is one).
+# Returns the number of queries answered.
+def run_batch(inputFile, outputFile, data_location="canteens.xlsx", workers=1, windowSize=1024):
+    init_worker(data_location)
+    pool = Pool(workers, initializer=init_worker, initargs=(data_location,)) if workers > 1 else None
+    numOfQueries = 0
+    try:
+        lines = (line for line in inputFile if line.strip())
+        while True:
+            window = list(islice(lines, windowSize))
+            if not window:
+                break
+            if pool is None:
+                answers = [answer_line(line) for line in window]
+            else:
+                answers = pool.map(answer_line, window, chunksize=max(1, len(window) // (workers * 4)))
+            outputFile.write("\n".join(answers) + "\n")
+            outputFile.flush()
+            numOfQueries += len(window)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return numOfQueries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer canteen search queries given as JSON lines on stdin, one JSON result per line on stdout.")
+    parser.add_argument("--data", default="canteens.xlsx", help="canteen dataset to search (default: canteens.xlsx)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1, no pool)")
+    parser.add_argument("--window", type=int, default=1024, help="number of queries read and answered at a time (default: 1024)")
+    parser.add_argument("--instrument", default=None, help="write the time of every stage of every query as JSON lines to this file (- for stderr)")
+    arguments = parser.parse_args(argv)
+
+    # Turned on before the workers start, so they record too
+    if arguments.instrument is not None:
+        instrumentation.enable(arguments.instrument)
+
+    start = time.perf_counter()
+    numOfQueries = run_batch(sys.stdin, sys.stdout, arguments.data, max(1, arguments.workers), max(1, arguments.window))
+    elapsed = time.perf_counter() - start
+
+    # Throughput goes to stderr so it does not mix with the results
+    print("Answered {} queries in {:.3f}s ({:.0f} queries/s)".format(numOfQueries, elapsed, numOfQueries / elapsed if elapsed > 0 else 0), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from catalog import load_catalog, read_snapshot_rows
+from generate_dataset import PRICE_DISTRIBUTIONS, generate_stalls, write_dataset
+from nearest_raster import MAP_SIZE
+from query_engine import natural_sort, query_keyword, query_nearest, query_price, queryCache
+
+# Benchmarks of the search paths on synthetic datasets of growing size (see generate_dataset.py).
+#   python benchmark.py                                     sizes 10^2 to 10^5 stalls
+#   python benchmark.py --sizes 1000000 --runs 50           a million stalls (the dataset takes a few minutes to generate once)
+#   python benchmark.py --save baseline.json                keep the results to compare later runs against
+#   python benchmark.py --compare baseline.json             report (and exit with status 1 on) regressions against a baseline
+# Each size times loading the catalog from its snapshot, building its indexes, and the searches behind the menu:
+#   keyword       search_by_keyword  (query_keyword)
+#   price         search_by_price    (query_price)
+#   nearest       search_nearest_canteens  (query_nearest)
+#   suggest       suggest_keyword    (the suggestion index, with a misspelt keyword)
+#   natural_sort  natural_sort of every canteen name
+# Searches are timed without the query cache (it is cleared before every call) and without printing, with inputs drawn at
+# random from the dataset. Times are reported as percentiles in milliseconds.
+# Generated datasets are kept in --data-dir and reused by later runs with the same options.
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+
+# A case is reported as a regression if its median is this many times the baseline's, and slower by more than MIN_DELTA_MS
+DEFAULT_TOLERANCE = 1.25
+MIN_DELTA_MS = 0.05
+
+
+# Returns summary statistics of a list of times in seconds, in milliseconds
+def summarise(samples):
+    samples = sorted(samples)
+    percentile = lambda fraction: samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000
+    return {
+        "runs": len(samples),
+        "meanMs": sum(samples) / len(samples) * 1000,
+        "minMs": samples[0] * 1000,
+        "p50Ms": percentile(0.50),
+        "p90Ms": percentile(0.90),
+        "p99Ms": percentile(0.99),
+        "maxMs": samples[-1] * 1000,
+    }
+
+
+# Calls search once for each input and returns the times in seconds. The query cache is cleared before each call, so every
+# call really searches.
+def time_searches(search, inputs):
+    samples = []
+    for searchInput in inputs:
+        queryCache.clear()
+        start = time.perf_counter()
+        search(*searchInput)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+# Returns a keyword with one letter changed, the kind of typo the suggestion index is there for
+def misspell(generator, keyword):
+    position = generator.randrange(len(keyword))
+    return keyword[:position] + generator.choice("abcdefghijklmnopqrstuvwxyz") + keyword[position + 1:]
+
+
+# Returns the workbook of a synthetic dataset, generating it (and its snapshot) if it is not in dataDirectory yet
+def dataset_location(dataDirectory, numOfStalls, options):
+    optionsKey = hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    path = os.path.join(dataDirectory, "stalls-{}-{}.xlsx".format(numOfStalls, optionsKey))
+    if not os.path.exists(path) or read_snapshot_rows(path) is None:
+        print("Generating a dataset of {} stalls...".format(numOfStalls), file=sys.stderr)
+        write_dataset(path, generate_stalls(numOfStalls, **options))
+    return path
+
+
+# Runs every benchmark on one dataset and returns {case: summary}
+def benchmark_dataset(path, runs, loadRuns, seed=0):
+    results = {}
+    loadSamples = []
+    buildSamples = []
+    for run in range(loadRuns):
+        start = time.perf_counter()
+        catalog = load_catalog(path)
+        loadSamples.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        catalog.build_indexes()
+        buildSamples.append(time.perf_counter() - start)
+    results["load_catalog"] = summarise(loadSamples)
+    results["build_indexes"] = summarise(buildSamples)
+
+    generator = random.Random(seed)
+    keywords = [keyword.lower() for keyword in catalog.suggestionIndex.keywords()]
+    results["keyword"] = summarise(time_searches(query_keyword, [(generator.choice(keywords), catalog) for run in range(runs)]))
+
+    priceRanges = []
+    for run in range(runs):
+        minPrice = round(generator.uniform(1.5, 10), 1)
+        priceRanges.append((minPrice, round(minPrice + generator.uniform(0.5, 5), 1), catalog))
+    results["price"] = summarise(time_searches(query_price, priceRanges))
+
+    locations = [((generator.randrange(MAP_SIZE[0]), generator.randrange(MAP_SIZE[1])), generator.randint(1, 5), catalog) for run in range(runs)]
+    results["nearest"] = summarise(time_searches(query_nearest, locations))
+
+    typos = [(misspell(generator, generator.choice(keywords)),) for run in range(runs)]
+    results["suggest"] = summarise(time_searches(lambda typo: catalog.suggestionIndex.suggest(typo, n=1, cutoff=0.5), typos))
+
+    results["natural_sort"] = summarise(time_searches(natural_sort, [(catalog.canteens,)] * runs))
+    return results
+
+
+# Compares results with a baseline and returns the regressions as (size, case, baseline ms, current ms)
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    for size, cases in results.items():
+        for case, summary in cases.items():
+            previous = baseline.get(size, {}).get(case)
+            if previous is None:
+                continue
+            if summary["p50Ms"] > previous["p50Ms"] * tolerance and summary["p50Ms"] - previous["p50Ms"] > MIN_DELTA_MS:
+                regressions.append((size, case, previous["p50Ms"], summary["p50Ms"]))
+    return regressions
+
+
+# Prints the results as a table, with the change in median against a baseline if there is one
+def print_table(results, baseline=None):
+    print("{:>9}  {:<14}{:>10}{:>10}{:>10}{:>10}  {}".format("stalls", "case", "p50 ms", "p90 ms", "p99 ms", "max ms", "vs baseline" if baseline else ""))
+    for size, cases in results.items():
+        for case, summary in cases.items():
+            change = ""
+            previous = (baseline or {}).get(size, {}).get(case)
+            if previous is not None and previous["p50Ms"] > 0:
+                change = "{:.2f}x".format(summary["p50Ms"] / previous["p50Ms"])
+            print("{:>9}  {:<14}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}  {}".format(
+                size, case, summary["p50Ms"], summary["p90Ms"], summary["p99Ms"], summary["maxMs"], change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark loading and searching synthetic canteen datasets of growing size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of stalls to benchmark (default: {})".format(" ".join(map(str, DEFAULT_SIZES))))
+    parser.add_argument("--runs", type=int, default=200, help="calls timed per search (default: 200)")
+    parser.add_argument("--load-runs", type=int, default=5, help="times each dataset is loaded and indexed (default: 5)")
+    parser.add_argument("--data-dir", default="benchmark_data", help="folder the generated datasets are kept in (default: benchmark_data)")
+    parser.add_argument("--stalls-per-canteen", type=int, default=50, help="stalls in each canteen (default: 50)")
+    parser.add_argument("--vocabulary", type=int, default=500, help="number of different keywords (default: 500)")
+    parser.add_argument("--prices", choices=PRICE_DISTRIBUTIONS, default="lognormal", help="price distribution (default: lognormal)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the datasets and the search inputs (default: 0)")
+    parser.add_argument("--save", default=None, help="write the results to this JSON file, to be used as a baseline")
+    parser.add_argument("--compare", default=None, help="compare the results with a baseline JSON file written by --save")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="slowdown of the median counted as a regression (default: {})".format(DEFAULT_TOLERANCE))
+    arguments = parser.parse_args(argv)
+
+    options = {"stallsPerCanteen": arguments.stalls_per_canteen, "vocabularySize": arguments.vocabulary,
+               "priceDistribution": arguments.prices, "seed": arguments.seed}
+    results = {}
+    for numOfStalls in arguments.sizes:
+        path = dataset_location(arguments.data_dir, numOfStalls, options)
+        print("Benchmarking {} stalls...".format(numOfStalls), file=sys.stderr)
+        results[str(numOfStalls)] = benchmark_dataset(path, max(1, arguments.runs), max(1, arguments.load_runs), arguments.seed)
+
+    baseline = None
+    if arguments.compare is not None:
+        with open(arguments.compare, encoding="utf-8") as baselineFile:
+            baseline = json.load(baselineFile)["results"]
+    print_table(results, baseline)
+
+    if arguments.save is not None:
+        report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "platform": platform.platform(),
+                  "runs": arguments.runs, "options": options, "results": results}
+        with open(arguments.save, "w", encoding="utf-8") as reportFile:
+            json.dump(report, reportFile, indent=2)
+
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, arguments.tolerance)
+        for size, case, before, after in regressions:
+            print("REGRESSION: {} at {} stalls, median {:.3f}ms -> {:.3f}ms".format(case, size, before, after), file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+from array import array
+from collections import namedtuple
+from copy import copy
+from functools import cached_property, lru_cache
+from itertools import compress, count
+
+from instrumentation import Stage, timed
+from nearest_raster import open_raster, raster_location
+from path_graph import open_walking_index, paths_location
+from search_index import AutocompleteIndex, CanteenIndex, KeywordIndex, PriceIndex, SpatialIndex, SuggestionIndex
+
+# A single food stall in the dataset. The catalog keeps stalls in packed columns and only makes these records when asked.
+Stall = namedtuple("Stall", ["name", "canteen", "price", "keywords"])
+
+# Bump this whenever the layout of the snapshot file changes, so old snapshots are rebuilt instead of misread
+SNAPSHOT_FORMAT = "1"
+
+# The one NaN used for missing prices. hash() of a NaN depends on the object, so sharing one keeps the row hashes of
+# unchanged rows equal from one load to the next (see StallColumns.rowHashes).
+NAN = float("nan")
+
+# Catalogs that have already been loaded in this process, keyed on the absolute path of their data file
+_loadedCatalogs = {}
+
+
+# Returns the id of a string in an interning table (a list of distinct strings and a dict from string to id), adding it if needed
+def intern_id(strings, stringIds, string):
+    stringId = stringIds.get(string)
+    if stringId is None:
+        stringId = len(strings)
+        stringIds[string] = stringId
+        strings.append(string)
+    return stringId
+
+
+# Returns the shortest decimal that a 32-bit float rounds back to, e.g. 4.300000190734863 -> 4.3.
+# Prices are stored as 32-bit floats, so this gives back the price written in the dataset (up to 7 significant digits).
+@lru_cache(maxsize=1 << 16)
+def widen_price(price):
+    for digits in range(1, 10):
+        candidate = float("%.*g" % (digits, price))
+        if array("f", [candidate])[0] == price:
+            return candidate
+    return price
+
+
+# The stalls of the dataset stored column by column in packed arrays, so a stall costs a few dozen bytes instead of a tuple
+# of Python objects. A stall id is a position in the columns. The columns are only ever appended to and are shared by every
+# version of a catalog, each catalog only looks at the ids it knows about (see CanteenCatalog.alive).
+class StallColumns:
+    __slots__ = ("names", "nameOffsets", "canteenIds", "canteenNames", "canteenNameIds",
+                 "keywordIds", "keywordTexts", "keywordTextIds", "prices", "rowHashes")
+
+    def __init__(self):
+        # Stall names as one UTF-8 blob, the name of stall i is names[nameOffsets[i]:nameOffsets[i + 1]]
+        self.names = bytearray()
+        self.nameOffsets = array("Q", [0])
+
+        # The canteen and keyword string of each stall, as ids into a list holding each distinct string once
+        self.canteenIds = array("I")
+        self.canteenNames = []
+        self.canteenNameIds = {}
+        self.keywordIds = array("I")
+        self.keywordTexts = []
+        self.keywordTextIds = {}
+
+        self.prices = array("f")
+
+        # hash() of each stall as it was read from the dataset, so a reload can tell the unchanged rows apart without
+        # materialising every stall (see CanteenCatalog.patched). Only meaningful within this process.
+        self.rowHashes = array("q")
+
+    def __len__(self):
+        return len(self.prices)
+
+    # Adds a stall at the end of the columns and returns its id
+    def append(self, stall):
+        self.names += stall.name.encode("utf-8")
+        self.nameOffsets.append(len(self.names))
+        self.canteenIds.append(intern_id(self.canteenNames, self.canteenNameIds, stall.canteen))
+        self.keywordIds.append(intern_id(self.keywordTexts, self.keywordTextIds, stall.keywords))
+        self.prices.append(stall.price)
+        self.rowHashes.append(hash(stall))
+        return len(self.prices) - 1
+
+    def name(self, stallId):
+        return self.names[self.nameOffsets[stallId]:self.nameOffsets[stallId + 1]].decode("utf-8")
+
+    def canteen(self, stallId):
+        return self.canteenNames[self.canteenIds[stallId]]
+
+    def keywords(self, stallId):
+        return self.keywordTexts[self.keywordIds[stallId]]
+
+    def price(self, stallId):
+        return widen_price(self.prices[stallId])
+
+    # Returns a stall as a Stall record
+    def stall(self, stallId):
+        return Stall(self.name(stallId), self.canteen(stallId), self.price(stallId), self.keywords(stallId))
+
+
+# Holds everything we know about the canteens (canteens, stalls, keywords, prices and coordinates).
+# It is built once from the rows of the dataset and every loader / search function is served from it.
+# A catalog is never changed once built: reloading the data makes a new catalog (see patched()), so a query that is
+# still running on the old one keeps seeing consistent data.
+class CanteenCatalog:
+    @timed("build_catalog")
+    def __init__(self, rows, version=None):
+        # Identifies the data this catalog was built from (the SHA-256 of the source file)
+        self.version = version
+
+        canteenNames, self.locations, stalls = collect_rows(rows)
+
+        # Canteens sorted by name (case-insensitive). sorted() is stable, so ties keep their dataset order.
+        self.canteens = sorted(canteenNames, key=str.lower)
+
+        # A stall's id is its position in the columns. Ids never change during the life of the process: when the data is
+        # reloaded, new stalls are added at the end of the columns and removed stalls are marked as such in alive.
+        self.columns = StallColumns()
+        for stall in stalls:
+            self.columns.append(stall)
+
+        # File the catalog was loaded from, if any (set by load_catalog)
+        self.dataLocation = None
+
+        # alive[stallId] is 1 for the stalls in this catalog and 0 for the ones removed (or only found in other versions)
+        self.alive = bytearray(b"\x01") * len(stalls)
+        self.numOfStalls = len(stalls)
+
+    # Lists the ids of every stall in the catalog
+    def live_stall_ids(self):
+        if self.numOfStalls == len(self.alive):
+            return range(len(self.alive))
+        return (stallId for stallId, isAlive in enumerate(self.alive) if isAlive)
+
+    # Returns a stall of the catalog as a Stall record
+    def stall(self, stallId):
+        return self.columns.stall(stallId)
+
+    # Sort key listing stalls by name (case-insensitive), ties in the order they were added to the catalog
+    def stall_sort_key(self, stallId):
+        return (self.columns.name(stallId).lower(), stallId)
+
+    # Ids of every stall, sorted by name
+    @cached_property
+    def stallOrder(self):
+        return array("I", sorted(self.live_stall_ids(), key=self.stall_sort_key))
+
+    # Canteen id (position in canteens, as used by the spatial index) of each canteen
+    @cached_property
+    def canteenIds(self):
+        return {canteen: canteenId for canteenId, canteen in enumerate(self.canteens)}
+
+    # Search indexes are built the first time they are needed and then kept with the catalog
+    @cached_property
+    @timed("index.keyword")
+    def keywordIndex(self):
+        return KeywordIndex(self)
+
+    @cached_property
+    @timed("index.price")
+    def priceIndex(self):
+        return PriceIndex(self)
+
+    @cached_property
+    @timed("index.canteen")
+    def canteenIndex(self):
+        return CanteenIndex(self)
+
+    @cached_property
+    @timed("index.spatial")
+    def spatialIndex(self):
+        return SpatialIndex(self)
+
+    @cached_property
+    @timed("index.suggestion")
+    def suggestionIndex(self):
+        return SuggestionIndex(self)
+
+    @cached_property
+    @timed("index.autocomplete")
+    def autocompleteIndex(self):
+        return AutocompleteIndex(self)
+
+    # Precomputed nearest canteens of every pixel of the campus map, or None if none was generated for the dataset
+    # (see nearest_raster.py). It is generated again the first time it is needed after the canteens changed.
+    @cached_property
+    @timed("open_raster")
+    def nearestRaster(self):
+        if self.dataLocation is None:
+            return None
+        return open_raster(self, raster_location(self.dataLocation))
+
+    # Walking distances along the campus paths, or None if no path graph was given for the dataset (see path_graph.py)
+    @cached_property
+    @timed("index.walking")
+    def walkingIndex(self):
+        if self.dataLocation is None:
+            return None
+        return open_walking_index(self, paths_location(self.dataLocation))
+
+    # Builds every search index now rather than on first use, e.g. before a server starts taking requests
+    def build_indexes(self):
+        for index in ["keywordIndex", "priceIndex", "canteenIndex", "spatialIndex", "suggestionIndex", "autocompleteIndex"]:
+            getattr(self, index)
+
+    # Returns a new catalog for new rows of the dataset, along with the number of stalls (added, updated, removed).
+    # Stalls are matched on (canteen, stall name), and only the ones that were added, removed or changed are applied to
+    # the indexes built so far, which share everything else with this catalog's indexes. This catalog is left untouched.
+    # Unchanged rows are found by their hash alone, so only the stalls that changed are ever looked at one by one.
+    @timed("patch_catalog")
+    def patched(self, rows, version=None):
+        canteenNames, locations, stalls = collect_rows(rows)
+
+        catalog = copy(self)
+        catalog.__dict__.pop("stallOrder", None)
+        catalog.__dict__.pop("canteenIds", None)
+        catalog.version = version
+        # Stalls appended to the shared columns by other versions of the catalog are not part of this one
+        catalog.alive = self.alive + bytes(len(self.columns) - len(self.alive))
+
+        # Row hash -> id of every stall in this catalog, and the row hashes of the new rows
+        liveIds = dict(zip(compress(self.columns.rowHashes, self.alive), compress(count(), self.alive)))
+        rowHashes = list(map(hash, stalls))
+        newHashes = set(rowHashes)
+        if len(newHashes) == len(stalls) and len(liveIds) == self.numOfStalls:
+            addedHashes = newHashes - liveIds.keys()
+            removedIds = sorted(liveIds[rowHash] for rowHash in liveIds.keys() - newHashes)
+        else:
+            # Two different rows share a hash, so rows cannot be matched on hashes: every stall is removed and added again
+            addedHashes = newHashes
+            removedIds = list(self.live_stall_ids())
+
+        # An updated stall (same name and canteen) is removed and added again under a new id
+        removed = [(stallId, self.stall(stallId)) for stallId in removedIds]
+        removedCanteens = {stall.name: stall.canteen for stallId, stall in removed}
+        added = []
+        numOfUpdates = 0
+        for stall in compress(stalls, map(addedHashes.__contains__, rowHashes)):
+            numOfUpdates += removedCanteens.get(stall.name) == stall.canteen
+            added.append(self.columns.append(stall))
+            catalog.alive.append(1)
+        for stallId in removedIds:
+            catalog.alive[stallId] = 0
+        catalog.numOfStalls = self.numOfStalls + len(added) - len(removed)
+
+        # Patch the indexes that have been built. The spatial index, the nearest canteen raster and the walking distances are only
+        # kept if no canteen was added, removed or moved (and the paths did not change), otherwise they are rebuilt (they only hold
+        # canteens, not stalls) the next time they are needed.
+        catalog.canteens = sorted(canteenNames, key=str.lower)
+        catalog.locations = locations
+        canteensChanged = catalog.canteens != self.canteens or locations != self.locations
+        for name in ["keywordIndex", "priceIndex", "canteenIndex", "suggestionIndex", "autocompleteIndex", "spatialIndex", "nearestRaster",
+                     "walkingIndex"]:
+            if name in self.__dict__:
+                del catalog.__dict__[name]
+                if name not in ("spatialIndex", "nearestRaster", "walkingIndex"):
+                    catalog.__dict__[name] = self.__dict__[name].patched(catalog, removed, added)
+                elif not canteensChanged and (name != "walkingIndex" or self.walkingIndex is not None and self.walkingIndex.is_current()):
+                    catalog.__dict__[name] = self.__dict__[name]
+        # The patched autocomplete index already holds the stalls in sorted order
+        if "autocompleteIndex" in catalog.__dict__:
+            catalog.stallOrder = catalog.autocompleteIndex.stallIds
+
+        return (catalog, (len(added) - numOfUpdates, numOfUpdates, len(removed) - numOfUpdates))
+
+    # Returns {canteen: {stall: keywords}}, stalls listed in sorted order
+    def stall_keywords(self):
+        keywords = {canteen: {} for canteen in self.canteens}
+        for stallId in self.stallOrder:
+            stall = self.stall(stallId)
+            keywords[stall.canteen][stall.name] = stall.keywords
+        return keywords
+
+    # Returns {canteen: {stall: price}}, stalls listed in sorted order
+    def stall_prices(self):
+        prices = {canteen: {} for canteen in self.canteens}
+        for stallId in self.stallOrder:
+            stall = self.stall(stallId)
+            prices[stall.canteen][stall.name] = stall.price
+        return prices
+
+    # Returns {canteen: [x, y]}
+    def canteen_locations(self):
+        return {canteen: list(self.locations[canteen]) for canteen in self.canteens}
+
+
+# Reduces the rows of the dataset to what a catalog keeps: the canteen names in order of first appearance,
+# the location of each canteen (first row wins), and the stalls deduplicated by name (first row wins, same as
+# drop_duplicates on "Stall")
+def collect_rows(rows):
+    canteenNames = []
+    locations = {}
+    stalls = {}
+    for canteen, location, stall, price, keywords in rows:
+        if canteen not in locations:
+            canteenNames.append(canteen)
+            locations[canteen] = parse_location(location)
+        if stall not in stalls:
+            price = float(price)
+            stalls[stall] = Stall(stall, canteen, price if price == price else NAN, keywords)
+    return (canteenNames, locations, list(stalls.values()))
+
+
+# Converts a location cell such as "508,86" into an (x, y) tuple of integers
+def parse_location(location):
+    x, y = location.split(',')
+    return (int(x), int(y))
+
+
+# Reads the rows of the Excel dataset as (canteen, location, stall, price, keywords) tuples
+@timed("read_workbook")
+def read_catalog_rows(data_location):
+    # pandas (and openpyxl under it) is slow to import, so we only pay for it when the workbook really has to be parsed
+    import pandas as pd
+
+    with Stage("read_excel"):
+        canteen_data = pd.read_excel(data_location)
+
+    # Trim surrounding whitespace from every text column
+    for column in ["Canteen", "Location", "Stall", "Keywords"]:
+        canteen_data[column] = canteen_data[column].astype(str).str.strip()
+
+    return list(canteen_data[["Canteen", "Location", "Stall", "Price", "Keywords"]].itertuples(index=False, name=None))
+
+
+# Returns the SHA-256 of a file as a hex string
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# The compiled snapshot lives next to the workbook, e.g. canteens.xlsx -> canteens.snapshot.sqlite
+def snapshot_location(data_location):
+    return os.path.splitext(os.path.abspath(data_location))[0] + ".snapshot.sqlite"
+
+
+# Compiles the workbook into a SQLite snapshot, keyed on the workbook's mtime, size and hash.
+# Returns the rows that were written so the caller does not have to read them again.
+@timed("compile_snapshot")
+def compile_snapshot(data_location, rows=None, sourceHash=None):
+    path = os.path.abspath(data_location)
+    sourceStat = os.stat(path)
+    if sourceHash is None:
+        sourceHash = hash_file(path)
+    if rows is None:
+        rows = read_catalog_rows(path)
+
+    # Write to a temporary file first and move it into place, so readers never see a half written snapshot
+    snapshotPath = snapshot_location(path)
+    temporaryPath = "{}.{}.tmp".format(snapshotPath, os.getpid())
+    if os.path.exists(temporaryPath):
+        os.remove(temporaryPath)
+    connection = sqlite3.connect(temporaryPath)
+    try:
+        with connection:
+            connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            connection.execute("CREATE TABLE rows (row_id INTEGER PRIMARY KEY, canteen TEXT, location TEXT, stall TEXT, price REAL, keywords TEXT)")
+            connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ("format", SNAPSHOT_FORMAT),
+                ("source_mtime_ns", str(sourceStat.st_mtime_ns)),
+                ("source_size", str(sourceStat.st_size)),
+                ("source_sha256", sourceHash),
+            ])
+            connection.executemany("INSERT INTO rows (canteen, location, stall, price, keywords) VALUES (?, ?, ?, ?, ?)",
+                                   [(canteen, location, stall, float(price), keywords) for canteen, location, stall, price, keywords in rows])
+    finally:
+        connection.close()
+    os.replace(temporaryPath, snapshotPath)
+    return rows
+
+
+# Reads the rows from the snapshot of a workbook if the snapshot is still fresh.
+# Returns (rows, sourceHash), or None if there is no usable snapshot and the workbook has to be parsed.
+@timed("read_snapshot")
+def read_snapshot_rows(data_location):
+    path = os.path.abspath(data_location)
+    snapshotPath = snapshot_location(path)
+    if not os.path.exists(snapshotPath):
+        return None
+
+    try:
+        connection = sqlite3.connect(snapshotPath)
+        try:
+            meta = dict(connection.execute("SELECT key, value FROM meta"))
+            if meta.get("format") != SNAPSHOT_FORMAT:
+                return None
+
+            # A matching mtime and size is trusted as is. Otherwise (e.g. the file was touched or copied),
+            # we fall back to comparing hashes and only rebuild if the contents really changed.
+            sourceStat = os.stat(path)
+            if meta["source_mtime_ns"] != str(sourceStat.st_mtime_ns) or meta["source_size"] != str(sourceStat.st_size):
+                if hash_file(path) != meta["source_sha256"]:
+                    return None
+                with connection:
+                    connection.executemany("UPDATE meta SET value = ? WHERE key = ?", [
+                        (str(sourceStat.st_mtime_ns), "source_mtime_ns"),
+                        (str(sourceStat.st_size), "source_size"),
+                    ])
+
+            rows = connection.execute("SELECT canteen, location, stall, price, keywords FROM rows ORDER BY row_id").fetchall()
+            # SQLite stores a NaN (a missing price) as NULL, so it is turned back into NaN here
+            rows = [row if row[3] is not None else (row[0], row[1], row[2], NAN, row[4]) for row in rows]
+            return (rows, meta["source_sha256"])
+        finally:
+            connection.close()
+    # A corrupt, locked or outdated snapshot is not fatal, we just rebuild it from the workbook
+    except (sqlite3.Error, KeyError, OSError):
+        return None
+
+
+# Loads a catalog from the snapshot when it is fresh, otherwise parses the workbook and recompiles the snapshot
+@timed("load_catalog")
+def load_catalog(data_location="canteens.xlsx"):
+    path = os.path.abspath(data_location)
+    snapshot = read_snapshot_rows(path)
+    if snapshot is not None:
+        rows, sourceHash = snapshot
+    else:
+        sourceHash = hash_file(path)
+        rows = read_catalog_rows(path)
+        try:
+            compile_snapshot(path, rows, sourceHash)
+        # Not being able to write the snapshot (e.g. a read-only folder) only costs us the faster start next time
+        except (sqlite3.Error, OSError):
+            pass
+    catalog = CanteenCatalog(rows, sourceHash)
+    catalog.dataLocation = path
+    return catalog
+
+
+# Returns the catalog for the given dataset, reading the file only the first time it is asked for
+def get_catalog(data_location="canteens.xlsx"):
+    path = os.path.abspath(data_location)
+    if path not in _loadedCatalogs:
+        _loadedCatalogs[path] = load_catalog(path)
+    return _loadedCatalogs[path]
+
+
+# Picks up changes to a dataset that has already been loaded. The workbook is parsed again, but only the stalls that
+# changed are applied to the catalog's indexes, and the new catalog replaces the old one in a single assignment,
+# so every query sees either the old data or the new data, never a mix.
+# Returns (catalog, (added, updated, removed)), with None instead of the counts if the contents had not changed.
+@timed("reload_catalog")
+def reload_catalog(data_location="canteens.xlsx"):
+    path = os.path.abspath(data_location)
+    current = _loadedCatalogs.get(path)
+    if current is None:
+        return (get_catalog(path), None)
+
+    sourceHash = hash_file(path)
+    if sourceHash == current.version:
+        return (current, None)
+
+    rows = read_catalog_rows(path)
+    try:
+        compile_snapshot(path, rows, sourceHash)
+    except (sqlite3.Error, OSError):
+        pass
+    catalog, changes = current.patched(rows, sourceHash)
+    # If the canteens moved, generate the nearest canteen raster again here rather than in the first search that needs it
+    if os.path.exists(raster_location(path)):
+        catalog.nearestRaster
+    _loadedCatalogs[path] = catalog
+    return (catalog, changes)
+
+
+# Background thread polling a workbook for changes and reloading its catalog when it changes.
+# onReload(catalog, changes) is called after each reload, e.g. to log it.
+class CatalogWatcher(threading.Thread):
+    def __init__(self, data_location="canteens.xlsx", interval=1.0, onReload=None):
+        super().__init__(name="CatalogWatcher", daemon=True)
+        self.path = os.path.abspath(data_location)
+        self.interval = interval
+        self.onReload = onReload
+        self.stopped = threading.Event()
+
+    def run(self):
+        lastSeen = None
+        while not self.stopped.wait(self.interval):
+            try:
+                sourceStat = os.stat(self.path)
+                if (sourceStat.st_mtime_ns, sourceStat.st_size) == lastSeen:
+                    continue
+                # reload_catalog compares hashes, so a file that was only touched costs a hash and nothing more
+                lastSeen = (sourceStat.st_mtime_ns, sourceStat.st_size)
+                catalog, changes = reload_catalog(self.path)
+                if changes is not None and self.onReload is not None:
+                    self.onReload(catalog, changes)
+            # The file may be half written or briefly missing while it is being saved, we just try again next time
+            except Exception:
+                lastSeen = None
+
+    def stop(self):
+        self.stopped.set()
+
+
+# Compile step: python catalog.py [canteens.xlsx ...] rebuilds the snapshot of each workbook
+if __name__ == "__main__":
+    for data_location in (sys.argv[1:] or ["canteens.xlsx"]):
+        rows = compile_snapshot(data_location)
+        print("Compiled {} row(s) from {} into {}".format(len(rows), data_location, snapshot_location(data_location)))
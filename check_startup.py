@@ -0,0 +1,75 @@
+import argparse
+import json
+import subprocess
+import sys
+
+from catalog import compile_snapshot, read_snapshot_rows
+
+# Checks what starting the text menu costs: importing assignment.py, then a first keyword, price and nearest canteen search
+# from the compiled snapshot. None of it may import the modules only the map windows (pygame, PIL, NumPy) or parsing the
+# workbook (pandas, openpyxl) need, and importing assignment.py must stay within the budget.
+#   python check_startup.py [--data canteens.xlsx] [--budget 150] [--runs 5]
+# Prints the timings as JSON, and exits with status 1 if a check fails.
+
+# Modules the text menu and its searches must not import
+HEAVY_MODULES = ("pygame", "PIL", "numpy", "pandas", "openpyxl")
+
+# Milliseconds importing assignment.py may take
+IMPORT_BUDGET_MS = 150
+
+# Run in a new interpreter every time, so nothing has been imported yet
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import assignment
+imported = time.perf_counter()
+from query_engine import query_keyword, query_nearest, query_price
+catalog = assignment.get_catalog(sys.argv[1])
+query_keyword("chicken", catalog)
+query_price(3, 5, catalog)
+query_nearest((300, 400), 3, catalog)
+searched = time.perf_counter()
+print(json.dumps({"importMs": (imported - start) * 1000, "firstSearchMs": (searched - imported) * 1000,
+                  "heavyModules": [name for name in json.loads(sys.argv[2]) if name in sys.modules]}))
+"""
+
+
+# Starts a new interpreter, runs the text mode start up in it, and returns its timings and the heavy modules it imported
+def measure_startup(data_location):
+    output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, data_location, json.dumps(HEAVY_MODULES)],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that the text menu starts without the GUI and dataframe modules, within an import time budget.")
+    parser.add_argument("--data", default="canteens.xlsx", help="canteen dataset to search (default: canteens.xlsx)")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET_MS, help="milliseconds importing assignment.py may take (default: {})".format(IMPORT_BUDGET_MS))
+    parser.add_argument("--runs", type=int, default=5, help="number of start ups measured, the fastest counts (default: 5)")
+    arguments = parser.parse_args(argv)
+
+    # The searches must run from the compiled snapshot, so make sure it is up to date first (this may import pandas, here only)
+    if read_snapshot_rows(arguments.data) is None:
+        compile_snapshot(arguments.data)
+
+    runs = [measure_startup(arguments.data) for run in range(max(1, arguments.runs))]
+    report = {
+        "importMs": min(run["importMs"] for run in runs),
+        "firstSearchMs": min(run["firstSearchMs"] for run in runs),
+        "budgetMs": arguments.budget,
+        "heavyModules": sorted({name for run in runs for name in run["heavyModules"]}),
+    }
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if report["heavyModules"]:
+        failures.append("text mode imported {}".format(", ".join(report["heavyModules"])))
+    if report["importMs"] > arguments.budget:
+        failures.append("importing assignment.py took {:.1f}ms, over the {:.0f}ms budget".format(report["importMs"], arguments.budget))
+    for failure in failures:
+        print("FAILED: " + failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import math
+import os
+import random
+from itertools import accumulate
+
+from catalog import compile_snapshot
+from nearest_raster import MAP_SIZE
+
+# Synthetic canteen datasets of any size, for benchmarks and for trying the program on more than the real 31 stalls.
+# A dataset is a workbook in the same layout as canteens.xlsx, together with its compiled snapshot so it can be loaded
+# without parsing the workbook (which takes minutes for a million rows).
+#   python generate_dataset.py --stalls 100000 --out synthetic.xlsx
+#   python generate_dataset.py --canteens 200 --stalls-per-canteen 50 --vocabulary 2000 --prices uniform --out synthetic.xlsx
+# Canteens are named "Food Court 1", "Food Court 2", ... and placed at random on the map. Keywords are the real ones from
+# canteens.xlsx followed by made up words, and are used with a Zipf-like skew (a few keywords are on many stalls, most on few).
+
+# Keywords of the real dataset, used before any made up ones
+REAL_KEYWORDS = ["Chinese", "Mixed Rice", "Western", "Fries", "Burgers", "Halal", "Korean", "Spicy", "Chicken", "Rice",
+                 "Japanese", "Ramen", "Indian", "Malay", "Thai", "Noodles", "Soup", "Mala", "Vegetarian", "Drinks",
+                 "Dessert", "Ice Cream", "Coffee", "Fish", "Seafood", "Bubble Tea", "Pasta", "Steak", "Porridge", "Dim Sum"]
+
+# Syllables made up keywords are spelt with, e.g. "Kamori"
+SYLLABLES = ["ka", "mo", "ri", "sa", "lu", "ne", "to", "bi", "ga", "chu", "pe", "do", "fi", "ya", "zen", "qua"]
+
+# Words stall names are made of, besides a keyword
+STALL_KINDS = ["Kitchen", "Delights", "Corner", "House", "Express", "Stall", "Cuisine", "Eatery", "Bar", "Grill"]
+
+PRICE_DISTRIBUTIONS = ("uniform", "normal", "lognormal")
+
+
+# Returns the n-th made up keyword (all of them are different), e.g. 0 -> "Ka", 17 -> "Moka"
+def made_up_keyword(n):
+    syllables = []
+    while True:
+        syllables.append(SYLLABLES[n % len(SYLLABLES)])
+        n = n // len(SYLLABLES) - 1
+        if n < 0:
+            break
+    return "".join(reversed(syllables)).capitalize()
+
+
+# Returns a vocabulary of the given size: the real keywords first, then made up ones
+def keyword_vocabulary(vocabularySize):
+    vocabulary = REAL_KEYWORDS[:vocabularySize]
+    n = 0
+    while len(vocabulary) < vocabularySize:
+        vocabulary.append(made_up_keyword(n))
+        n += 1
+    return vocabulary
+
+
+# Returns a random price in S$ (rounded to 10 cents) between minPrice and maxPrice, drawn from one of PRICE_DISTRIBUTIONS
+def random_price(generator, distribution, minPrice, maxPrice):
+    if distribution == "uniform":
+        price = generator.uniform(minPrice, maxPrice)
+    elif distribution == "normal":
+        price = generator.gauss((minPrice + maxPrice) / 2, (maxPrice - minPrice) / 6)
+    else:
+        # Most stalls are cheap and a few are expensive, like the real dataset (median S$5, up to S$15)
+        price = minPrice + generator.lognormvariate(math.log((maxPrice - minPrice) / 4), 0.6)
+    return round(min(maxPrice, max(minPrice, price)), 1)
+
+
+# Generates the rows of a dataset as (canteen, location, stall, price, keywords) tuples, like catalog.read_catalog_rows
+def generate_rows(numOfCanteens, stallsPerCanteen, vocabularySize=500, keywordsPerStall=(1, 4), priceDistribution="lognormal",
+                  minPrice=1.5, maxPrice=15.0, seed=0):
+    generator = random.Random(seed)
+    vocabulary = keyword_vocabulary(max(1, vocabularySize))
+    # Zipf-like weights: the i-th keyword is used about 1 / (i + 1) as often as the first
+    cumulativeWeights = list(accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    fewestKeywords, mostKeywords = keywordsPerStall
+    mostKeywords = min(mostKeywords, len(vocabulary))
+    fewestKeywords = min(fewestKeywords, mostKeywords)
+
+    rows = []
+    for canteenNumber in range(1, numOfCanteens + 1):
+        canteen = "Food Court {}".format(canteenNumber)
+        location = "{},{}".format(generator.randrange(MAP_SIZE[0]), generator.randrange(MAP_SIZE[1]))
+        for stallNumber in range(1, stallsPerCanteen + 1):
+            numOfKeywords = generator.randint(fewestKeywords, mostKeywords)
+            keywords = []
+            while len(keywords) < numOfKeywords:
+                keyword = generator.choices(vocabulary, cum_weights=cumulativeWeights)[0]
+                if keyword not in keywords:
+                    keywords.append(keyword)
+            # Stall names must be unique across the dataset, the catalog keeps only the first stall of each name
+            stall = "{} {} {}-{}".format(keywords[0], generator.choice(STALL_KINDS), canteenNumber, stallNumber)
+            rows.append((canteen, location, stall, random_price(generator, priceDistribution, minPrice, maxPrice), ", ".join(keywords)))
+    return rows
+
+
+# Generates the rows of a dataset of numOfStalls stalls, in canteens of stallsPerCanteen (the last one may have fewer).
+# The other options are those of generate_rows.
+def generate_stalls(numOfStalls, stallsPerCanteen=50, **options):
+    stallsPerCanteen = max(1, stallsPerCanteen)
+    return generate_rows(max(1, -(-numOfStalls // stallsPerCanteen)), stallsPerCanteen, **options)[:max(1, numOfStalls)]
+
+
+# Writes rows to a workbook laid out like canteens.xlsx (an unnamed index column, then Canteen, Location, Stall, Price, Keywords)
+def write_workbook(path, rows):
+    # openpyxl is only needed to write workbooks, not to generate or load datasets
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([None, "Canteen", "Location", "Stall", "Price", "Keywords"])
+    for index, row in enumerate(rows):
+        sheet.append([index, *row])
+    workbook.save(path)
+
+
+# Writes a generated dataset: the workbook, then its snapshot so loading it does not have to parse the workbook
+def write_dataset(path, rows):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    write_workbook(path, rows)
+    compile_snapshot(path, rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic canteen dataset (workbook and snapshot) of any size.")
+    parser.add_argument("--out", default="synthetic.xlsx", help="workbook to write, the snapshot goes next to it (default: synthetic.xlsx)")
+    parser.add_argument("--stalls", type=int, default=None, help="total number of stalls, split into canteens of --stalls-per-canteen")
+    parser.add_argument("--canteens", type=int, default=20, help="number of canteens, if --stalls is not given (default: 20)")
+    parser.add_argument("--stalls-per-canteen", type=int, default=50, help="stalls in each canteen (default: 50)")
+    parser.add_argument("--vocabulary", type=int, default=500, help="number of different keywords (default: 500)")
+    parser.add_argument("--keywords", type=int, nargs=2, default=[1, 4], metavar=("FEWEST", "MOST"), help="keywords per stall (default: 1 4)")
+    parser.add_argument("--prices", choices=PRICE_DISTRIBUTIONS, default="lognormal", help="price distribution (default: lognormal)")
+    parser.add_argument("--min-price", type=float, default=1.5, help="cheapest price in S$ (default: 1.5)")
+    parser.add_argument("--max-price", type=float, default=15.0, help="most expensive price in S$ (default: 15)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed, the same seed and options give the same dataset (default: 0)")
+    arguments = parser.parse_args(argv)
+
+    stallsPerCanteen = max(1, arguments.stalls_per_canteen)
+    numOfStalls = arguments.stalls if arguments.stalls is not None else max(1, arguments.canteens) * stallsPerCanteen
+    rows = generate_stalls(numOfStalls, stallsPerCanteen, vocabularySize=arguments.vocabulary, keywordsPerStall=tuple(arguments.keywords),
+                           priceDistribution=arguments.prices, minPrice=arguments.min_price, maxPrice=arguments.max_price, seed=arguments.seed)
+    write_dataset(arguments.out, rows)
+    print("Wrote {} stalls in {} canteens to {}".format(len(rows), len({row[0] for row in rows}), arguments.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from functools import wraps
+
+# Timers and counters around each stage of a search (parsing the workbook, building the catalog and its indexes, the search
+# itself, natural_sort, difflib suggestions, loading the map images), to see where the time of a slow search went.
+# Off by default. Turned on with the CANTEEN_INSTRUMENT environment variable (or --instrument in batch_search.py and
+# search_server.py), set to a file to write JSON lines to, or to - for stderr:
+#   CANTEEN_INSTRUMENT=stages.jsonl python assignment.py
+# Every query writes one line with its total time and the time spent in each stage under it, e.g.
+#   {"type": "query", "name": "query_keyword", "args": ["'chicken'"], "totalMs": 0.31, "stages": {"group_by_canteen": 0.12, ...}, "counts": {...}}
+# and a summary with a histogram of the times of every stage and the totals of every counter is written at exit.
+# When it is off, a timed function only costs one extra call and check, and a counter one call.
+# A single query can also be profiled with cProfile (cpu) or tracemalloc (memory):
+#   python instrumentation.py --profile cpu '{"type": "keyword", "keyword": "chicken"}'
+
+# Upper bounds of the histogram buckets, in microseconds (a final bucket holds anything slower)
+BUCKET_BOUNDS_US = [1 << power for power in range(0, 25, 2)]
+
+_enabled = False
+_output = None
+_lock = threading.Lock()
+# Aggregate times of each stage, by name: [count, total seconds, max seconds, bucket counts]
+_stages = {}
+# Totals of each counter, by name
+_counters = {}
+# The query being timed on each thread, if any
+_current = threading.local()
+
+
+# Starts recording, writing JSON lines to path (- for stderr). Worker processes started afterwards record too.
+def enable(path="-"):
+    global _enabled, _output
+    os.environ["CANTEEN_INSTRUMENT"] = path
+    with _lock:
+        if _output is not None and _output is not sys.stderr:
+            _output.close()
+        _output = sys.stderr if path == "-" else open(path, "a", buffering=1, encoding="utf-8")
+        _enabled = True
+
+
+def is_enabled():
+    return _enabled
+
+
+# Adds one timing of a stage to the aggregates, and to the query being timed on this thread
+def record_stage(name, seconds):
+    microseconds = seconds * 1e6
+    bucket = next((index for index, bound in enumerate(BUCKET_BOUNDS_US) if microseconds <= bound), len(BUCKET_BOUNDS_US))
+    with _lock:
+        stage = _stages.get(name)
+        if stage is None:
+            stage = _stages[name] = [0, 0.0, 0.0, [0] * (len(BUCKET_BOUNDS_US) + 1)]
+        stage[0] += 1
+        stage[1] += seconds
+        stage[2] = max(stage[2], seconds)
+        stage[3][bucket] += 1
+    query = getattr(_current, "query", None)
+    if query is not None:
+        query["stages"][name] = query["stages"].get(name, 0.0) + seconds * 1000
+
+
+# Adds n to a counter, e.g. the number of stalls a search matched
+def count(name, n=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+    query = getattr(_current, "query", None)
+    if query is not None:
+        query["counts"][name] = query["counts"].get(name, 0) + n
+
+
+# Short descriptions of the arguments of a query, leaving out the catalog and other objects
+def describe_arguments(args):
+    return [repr(value)[:80] for value in args if isinstance(value, (str, int, float, tuple, list, dict))]
+
+
+# Decorator timing every call of a function as the stage name.
+# A query is the outermost timed call with query=True on a thread: it writes a line with the stages timed under it.
+# Queries called from inside a query (e.g. the keyword part of a combined search) are timed as a stage of the outer one.
+def timed(name, query=False):
+    def decorate(function):
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+
+            outermost = query and getattr(_current, "query", None) is None
+            if outermost:
+                _current.query = {"type": "query", "name": name, "args": describe_arguments(args), "totalMs": 0.0, "stages": {}, "counts": {}}
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                if outermost:
+                    record = _current.query
+                    _current.query = None
+                    record["totalMs"] = seconds * 1000
+                    record_stage(name, seconds)
+                    write_line(record)
+                else:
+                    record_stage(name, seconds)
+        return timed_function
+    return decorate
+
+
+# Times a block of code as the stage name, for stages that are only part of a function:
+#   with Stage("read_excel"):
+#       ...
+class Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter() if _enabled else None
+        return self
+
+    def __exit__(self, *exception):
+        if self.start is not None:
+            record_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def write_line(record):
+    with _lock:
+        if _output is not None:
+            _output.write(json.dumps(record) + "\n")
+
+
+# Returns the aggregates so far: for each stage its count, total, mean and max time and the histogram of its times
+# (bucket upper bound in microseconds -> calls, "inf" for slower), and the totals of the counters
+def summary():
+    with _lock:
+        stages = {}
+        for name, (calls, totalSeconds, maxSeconds, buckets) in sorted(_stages.items()):
+            histogram = {str(bound): calls for bound, calls in zip(BUCKET_BOUNDS_US + ["inf"], buckets) if calls}
+            stages[name] = {"count": calls, "totalMs": totalSeconds * 1000, "meanMs": totalSeconds / calls * 1000,
+                            "maxMs": maxSeconds * 1000, "histogramUs": histogram}
+        return {"type": "summary", "stages": stages, "counters": dict(sorted(_counters.items()))}
+
+
+@atexit.register
+def write_summary():
+    if _enabled and _stages:
+        write_line(summary())
+
+
+# Runs one call under cProfile (mode "cpu") or tracemalloc (mode "memory") and prints what it found.
+# Returns the call's result. If outputPath is given, the cProfile stats are also saved there (for pstats or snakeviz).
+def capture(mode, call, outputPath=None, limit=25):
+    if mode == "cpu":
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        result = profiler.runcall(call)
+        if outputPath is not None:
+            profiler.dump_stats(outputPath)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(limit)
+        return result
+
+    import tracemalloc
+
+    tracemalloc.start(25)
+    before = tracemalloc.take_snapshot()
+    result = call()
+    after = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("Allocated {} bytes still in use, peak {} bytes".format(current, peak), file=sys.stderr)
+    for difference in after.compare_to(before, "lineno")[:limit]:
+        print(difference, file=sys.stderr)
+    return result
+
+
+# Turns recording on if CANTEEN_INSTRUMENT is set
+if os.environ.get("CANTEEN_INSTRUMENT"):
+    enable(os.environ["CANTEEN_INSTRUMENT"])
+
+
+def main(argv=None):
+    # The query layer is only needed to run a query, not to record stages
+    from catalog import get_catalog
+    from query_engine import result_as_dict, run_query
+
+    parser = argparse.ArgumentParser(description="Profile a single canteen search query with cProfile or tracemalloc.")
+    parser.add_argument("query", help='JSON query, same format as batch_search.py, e.g. {"type": "keyword", "keyword": "chicken"}')
+    parser.add_argument("--profile", choices=("cpu", "memory"), default="cpu", help="cProfile (cpu) or tracemalloc (memory) (default: cpu)")
+    parser.add_argument("--data", default="canteens.xlsx", help="canteen dataset to search (default: canteens.xlsx)")
+    parser.add_argument("--out", default=None, help="also save the cProfile stats to this file")
+    parser.add_argument("--limit", type=int, default=25, help="number of functions or lines to print (default: 25)")
+    parser.add_argument("--cold", action="store_true", help="include loading the catalog and building its indexes in the capture")
+    arguments = parser.parse_args(argv)
+
+    query = json.loads(arguments.query)
+    if not arguments.cold:
+        get_catalog(arguments.data).build_indexes()
+    result = capture(arguments.profile, lambda: run_query(query, get_catalog(arguments.data)), arguments.out, arguments.limit)
+    print(json.dumps({"result": result_as_dict(result)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import re
+from collections import namedtuple
+
+# Boolean keyword queries, e.g.  halal AND noodles NOT spicy  or  "fried rice" OR (mala NOT soup)
+#   AND      both sides must match, also implied between two keywords (halal noodles = halal AND noodles)
+#   OR       either side may match, binds looser than AND
+#   NOT      the keyword after it must not match
+#   "..."    a phrase, matched as one search term (spaces included)
+#   ( ... )  grouping
+# Operators are only recognised in uppercase, keywords and phrases are matched case-insensitively like a single keyword search.
+# Queries are evaluated over the keyword strings of the KeywordIndex (every stall sharing a keyword string matches alike),
+# and only the stalls of the keyword strings left at the end are looked up.
+
+# Nodes of a parsed query. Terms are lowercase, the operands of And and Or are tuples of nodes.
+Term = namedtuple("Term", ["text"])
+And = namedtuple("And", ["operands"])
+Or = namedtuple("Or", ["operands"])
+Not = namedtuple("Not", ["operand"])
+
+OPERATORS = ("AND", "OR", "NOT")
+
+# Most brackets a query may have open at once, so a pathological query cannot exhaust the parser's recursion
+MAX_NESTING = 100
+
+# A phrase (possibly missing its closing quote), a bracket, or a run of anything else up to a space, bracket or quote
+TOKEN_PATTERN = re.compile(r'"[^"]*"?|[()]|[^\s()"]+')
+
+
+# Raised when a keyword query cannot be parsed. It is a ValueError, so callers that check input that way still catch it.
+class QuerySyntaxError(ValueError):
+    pass
+
+
+# Returns True if a keyword search uses the boolean syntax, rather than being one plain keyword
+def is_boolean_query(keyword):
+    return len(keyword.split()) != 1 or any(character in keyword for character in '"()')
+
+
+# Recursive descent parser over the tokens of a query
+class QueryParser:
+    def __init__(self, text):
+        self.tokens = TOKEN_PATTERN.findall(text)
+        self.position = 0
+        # Number of brackets open at the current position
+        self.depth = 0
+
+    # Returns the next token without consuming it, or None at the end of the query
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QuerySyntaxError("The keyword query is empty.")
+        query = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError("Unexpected '{}' in the keyword query.".format(self.peek()))
+        return query
+
+    # orQuery := andQuery ("OR" andQuery)*
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == "OR":
+            self.next()
+            operands.append(self.parse_and())
+        return combine(Or, operands)
+
+    # andQuery := notQuery (["AND"] notQuery)*
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.peek() not in (None, "OR", ")"):
+            if self.peek() == "AND":
+                self.next()
+            operands.append(self.parse_not())
+        return combine(And, operands)
+
+    # notQuery := "NOT" notQuery | atom
+    # A run of NOTs is counted rather than recursed into, and two of them cancel out
+    def parse_not(self):
+        numOfNots = 0
+        while self.peek() == "NOT":
+            self.next()
+            numOfNots += 1
+        operand = self.parse_atom()
+        if numOfNots % 2 == 0:
+            return operand
+        return operand.operand if isinstance(operand, Not) else Not(operand)
+
+    # atom := keyword | "phrase" | "(" orQuery ")"
+    def parse_atom(self):
+        previous = self.tokens[self.position - 1] if self.position > 0 else None
+        token = self.next()
+        if token is None:
+            raise QuerySyntaxError("Expected a keyword after '{}'.".format(previous) if previous else "The keyword query is empty.")
+        if token == "(":
+            if self.depth >= MAX_NESTING:
+                raise QuerySyntaxError("The keyword query nests brackets more than {} deep.".format(MAX_NESTING))
+            self.depth += 1
+            query = self.parse_or()
+            if self.next() != ")":
+                raise QuerySyntaxError("Missing ')' in the keyword query.")
+            self.depth -= 1
+            return query
+        if token == ")" or token in OPERATORS:
+            raise QuerySyntaxError("Expected a keyword but found '{}'.".format(token))
+        if token.startswith('"'):
+            if len(token) < 2 or not token.endswith('"'):
+                raise QuerySyntaxError("Missing closing quote in the keyword query.")
+            if not token[1:-1].strip():
+                raise QuerySyntaxError("Quoted phrases cannot be empty.")
+            return Term(token[1:-1].strip().lower())
+        return Term(token.lower())
+
+
+# Returns a node combining operands with And or Or. A single operand is returned as it is, and nested nodes of the same kind
+# are flattened (a AND (b AND c) = a AND b AND c).
+def combine(nodeType, operands):
+    if len(operands) == 1:
+        return operands[0]
+    flattened = []
+    for operand in operands:
+        flattened.extend(operand.operands if isinstance(operand, nodeType) else [operand])
+    return nodeType(tuple(flattened))
+
+
+# Parses a keyword query into a tree of Term, And, Or and Not nodes. Raises QuerySyntaxError if it is malformed.
+def parse_keyword_query(text):
+    return QueryParser(text).parse()
+
+
+# Returns the terms used in a query, e.g. to check that each of them is long enough
+def query_terms(query):
+    if isinstance(query, Term):
+        return [query.text]
+    if isinstance(query, Not):
+        return query_terms(query.operand)
+    return [term for operand in query.operands for term in query_terms(operand)]
+
+
+# Writes a parsed query back out in a standard form, e.g. 'Halal  and noodles' -> 'halal AND noodles'.
+# Queries that mean the same (up to spacing, brackets and case) get the same text, so they share a cache entry.
+def query_text(query):
+    if isinstance(query, Term):
+        simple = query.text not in (operator.lower() for operator in OPERATORS) and re.fullmatch(r'[^\s()"]+', query.text)
+        return query.text if simple else '"{}"'.format(query.text)
+    if isinstance(query, Not):
+        return "NOT " + bracketed(query.operand)
+    if isinstance(query, And):
+        return " AND ".join(bracketed(operand) for operand in query.operands)
+    return " OR ".join(query_text(operand) for operand in query.operands)
+
+
+def bracketed(query):
+    return "({})".format(query_text(query)) if isinstance(query, (And, Or)) else query_text(query)
+
+
+# Returns a rough, cheap to work out number of keyword strings a query matches, used to evaluate the cheapest parts first
+def estimate(query, index):
+    if isinstance(query, Term):
+        return index.estimate_texts(query.text)
+    if isinstance(query, Not):
+        return len(index.texts)
+    if isinstance(query, And):
+        return min(estimate(operand, index) for operand in query.operands)
+    return sum(estimate(operand, index) for operand in query.operands)
+
+
+# Returns the set of ids of the keyword strings in the KeywordIndex that match a query
+def matching_texts(query, index):
+    if isinstance(query, Term):
+        return index.texts_matching(query.text)
+    if isinstance(query, Not):
+        return set(range(len(index.texts))) - matching_texts(query.operand, index)
+    if isinstance(query, Or):
+        found = set()
+        for operand in query.operands:
+            found |= matching_texts(operand, index)
+        return found
+
+    # AND: intersect the operands, smallest estimate first, then take away the NOT operands.
+    # We stop as soon as nothing is left, so the remaining (more expensive) operands are never evaluated.
+    included = sorted((operand for operand in query.operands if not isinstance(operand, Not)), key=lambda operand: estimate(operand, index))
+    excluded = sorted((operand.operand for operand in query.operands if isinstance(operand, Not)), key=lambda operand: estimate(operand, index))
+    found = matching_texts(included[0], index) if included else set(range(len(index.texts)))
+    for operand in included[1:]:
+        if not found:
+            return found
+        found &= matching_texts(operand, index)
+    for operand in excluded:
+        if not found:
+            return found
+        found -= matching_texts(operand, index)
+    return found
+
+
+# Returns the set of ids of the stalls matching a parsed query
+def search_query(query, index):
+    return index.stalls_using(matching_texts(query, index))
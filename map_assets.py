@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import struct
+
+import pygame
+
+from instrumentation import timed
+
+# Decoded, already scaled images for the map windows (the campus map and the pins).
+# Each image is decoded and scaled once per process and then shared by every window that shows it. The scaled pixels are also
+# kept on disk next to the image (e.g. NTUcampus.jpg -> NTUcampus.620x750.pixels), keyed on the image's hash and the size,
+# so later runs skip decoding the JPEG and resampling it. The pixel files are only a cache and can be deleted at any time.
+
+PIXELS_MAGIC = b"PIXELS01"
+
+# Scaled images of this process, by (image path, size, alpha, converted for the display)
+_loadedImages = {}
+
+
+# Returns where the scaled pixels of an image are kept, e.g. NTUcampus.jpg at 620 x 750 -> NTUcampus.620x750.pixels
+def pixels_location(image_location, size):
+    return "{}.{}x{}.pixels".format(os.path.splitext(os.path.abspath(image_location))[0], *size)
+
+
+def hash_image(path):
+    with open(path, "rb") as imageFile:
+        return hashlib.sha256(imageFile.read()).hexdigest()
+
+
+# Reads the scaled pixels of an image from its pixel file, or returns None if there is none for this version of the image
+def read_pixels(path, sourceHash, size, pixelFormat):
+    try:
+        with open(path, "rb") as pixelsFile:
+            if pixelsFile.read(len(PIXELS_MAGIC)) != PIXELS_MAGIC:
+                return None
+            headerSize, = struct.unpack("<I", pixelsFile.read(4))
+            header = json.loads(pixelsFile.read(headerSize).decode("utf-8"))
+            pixels = pixelsFile.read()
+    except (OSError, ValueError, struct.error):
+        return None
+    if header != {"source": sourceHash, "size": list(size), "format": pixelFormat} or len(pixels) != size[0] * size[1] * len(pixelFormat):
+        return None
+    return pixels
+
+
+# Writes the scaled pixels of an image to its pixel file. Failing to write (e.g. a read-only folder) only means no cache.
+def write_pixels(path, sourceHash, size, pixelFormat, pixels):
+    headerBytes = json.dumps({"source": sourceHash, "size": list(size), "format": pixelFormat}).encode("utf-8")
+    # Write to a temporary file first and move it into place, so readers never see a half written file
+    temporaryPath = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(temporaryPath, "wb") as pixelsFile:
+            pixelsFile.write(PIXELS_MAGIC + struct.pack("<I", len(headerBytes)) + headerBytes + pixels)
+        os.replace(temporaryPath, path)
+    except OSError:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+
+
+# Loads an image as a surface of plain RGB or RGBA pixels (pixelFormat), which smoothscale can scale whatever format the
+# image was stored in (e.g. with a palette)
+def decode_image(image_location, pixelFormat):
+    decoded = pygame.image.load(image_location)
+    return pygame.image.frombuffer(pygame.image.tobytes(decoded, pixelFormat), decoded.get_size(), pixelFormat)
+
+
+# Returns an image scaled to size as a pygame Surface, with its transparency if alpha is True.
+# If a window is open the surface is converted to the window's pixel format, so drawing it is a plain copy.
+# The surface is shared, so callers must not draw on it (draw on a copy instead).
+@timed("load_image")
+def load_image(image_location, size, alpha=False):
+    size = tuple(size)
+    converted = pygame.display.get_surface() is not None
+    key = (os.path.abspath(image_location), size, alpha, converted)
+    if key in _loadedImages:
+        return _loadedImages[key]
+
+    pixelFormat = "RGBA" if alpha else "RGB"
+    sourceHash = hash_image(image_location)
+    pixelsPath = pixels_location(image_location, size)
+    pixels = read_pixels(pixelsPath, sourceHash, size, pixelFormat)
+    if pixels is None:
+        image = pygame.transform.smoothscale(decode_image(image_location, pixelFormat), size)
+        pixels = pygame.image.tobytes(image, pixelFormat)
+        write_pixels(pixelsPath, sourceHash, size, pixelFormat, pixels)
+
+    image = pygame.image.frombuffer(pixels, size, pixelFormat)
+    if converted:
+        image = image.convert_alpha() if alpha else image.convert()
+    else:
+        # frombuffer shares the bytes, a copy gives the surface its own pixels
+        image = image.copy()
+    _loadedImages[key] = image
+    return image
@@ -0,0 +1,231 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from functools import lru_cache
+from itertools import islice
+from math import isfinite
+from multiprocessing import Pool
+
+import pygame
+from PIL import Image
+
+from catalog import get_catalog
+from map_assets import load_image
+from nearest_raster import MAP_SIZE
+from query_engine import query_nearest, query_walking, walking_route
+
+# Nearest canteen maps drawn off-screen and saved as PNG, with the same pins and labels as the results window of assignment.py,
+# e.g. for the web page or for a batch of users. No window is opened, so this also works without a display.
+#   python map_render.py --out maps < users.jsonl > rendered.jsonl
+#   python map_render.py --out maps --workers 4 < users.jsonl > rendered.jsonl
+# Each line of input is a user location, {"x": 300, "y": 400, "k": 3}, optionally with an "id", "walking": true to search by
+# walking distance, or "results": [[canteen, distance], ...] to draw given results instead of searching.
+# Maps are written to the output folder as <line number>.png, and one JSON line per map is written to stdout
+# ({"file": ...} or {"error": ...}, plus the "id" if there was one), in the same order as the input.
+
+MAP_IMAGE = "NTUcampus.jpg"
+PIN_IMAGE = "pin.png"
+FOOD_PIN_IMAGE = "food_pin.png"
+PIN_SIZE = (50, 50)
+
+LABEL_COLOUR = (255, 255, 255)
+LABEL_BACKGROUND = (0, 0, 0)
+ROUTE_COLOUR = (0, 102, 204)
+
+# zlib level of the PNGs, 3 is about twice as fast as the default for files of the same size
+PNG_COMPRESSION = 3
+
+# Dataset used by this process (set once per worker, so the catalog and the images are only loaded once)
+_dataLocation = "canteens.xlsx"
+
+
+# Renders the label of each canteen in a list of (canteen, distance) results, e.g. " Food Court 1 (120m)"
+def render_labels(font, results):
+    return [font.render(" {} ({}m)".format(canteenName, int(distance)), True, LABEL_COLOUR, LABEL_BACKGROUND) for canteenName, distance in results]
+
+
+# Draws the results of a nearest canteen search onto a surface: walking routes, the user location pin, then the canteen pins
+# with their labels (already rendered, one per result) on top. toSurface turns map coordinates into positions on the surface,
+# e.g. MapView.to_screen when the map is zoomed in. By default they are the same.
+def draw_results(surface, pin, foodPin, labels, userLocation, results, locationList, routes=None, routeColour=ROUTE_COLOUR, toSurface=None):
+    if toSurface is None:
+        toSurface = lambda location: location
+
+    # Walking routes go under the pins
+    if routes is not None:
+        for route in routes.values():
+            if len(route) >= 2:
+                pygame.draw.lines(surface, routeColour, False, [toSurface(point) for point in route], 3)
+    userX, userY = toSurface(userLocation)
+    surface.blit(pin, (userX - 25, userY - 42))
+
+    # Display canteen pins first, then overlay text on top
+    for canteenName, distance in results:
+        xLocation, yLocation = toSurface(locationList[canteenName])
+        surface.blit(foodPin, (xLocation - 25, yLocation - 50))
+    for (canteenName, distance), canteenText in zip(results, labels):
+        xLocation, yLocation = toSurface(locationList[canteenName])
+        surface.blit(canteenText, ((xLocation - canteenText.get_width() // 2), yLocation - 20))
+
+
+# Draws the results of a nearest canteen search over a copy of the map and returns it
+def draw_nearest_canteens(ntuMap, pin, foodPin, labels, userLocation, results, locationList, routes=None, routeColour=ROUTE_COLOUR):
+    scene = ntuMap.copy()
+    draw_results(scene, pin, foodPin, labels, userLocation, results, locationList, routes, routeColour)
+    return scene
+
+
+# The label font, loaded once per process
+@lru_cache(maxsize=None)
+def label_font():
+    pygame.font.init()
+    return pygame.font.SysFont("Arial", 10)
+
+
+# Returns a surface as PNG bytes
+def png_bytes(surface):
+    output = io.BytesIO()
+    Image.frombuffer("RGB", surface.get_size(), pygame.image.tobytes(surface, "RGB")).save(output, "PNG", compress_level=PNG_COMPRESSION)
+    return output.getvalue()
+
+
+# Draws a nearest canteen map off-screen and returns it as PNG bytes.
+# results is a list of (canteen, distance), routes optionally maps canteens to the walk there as a list of (x, y) points.
+def render_nearest_canteens(userLocation, results, routes=None, data_location="canteens.xlsx"):
+    scene = draw_nearest_canteens(load_image(MAP_IMAGE, MAP_SIZE), load_image(PIN_IMAGE, PIN_SIZE, alpha=True),
+                                  load_image(FOOD_PIN_IMAGE, PIN_SIZE, alpha=True), render_labels(label_font(), results),
+                                  userLocation, results, get_catalog(data_location).locations, routes)
+    return png_bytes(scene)
+
+
+# Loads the catalog, the images and the font for this process, run once when a worker starts.
+# Workers forked after the first call share what it loaded, others read the images from the pixel files of map_assets.
+def init_worker(data_location):
+    global _dataLocation
+    _dataLocation = data_location
+    get_catalog(data_location)
+    load_image(MAP_IMAGE, MAP_SIZE)
+    load_image(PIN_IMAGE, PIN_SIZE, alpha=True)
+    load_image(FOOD_PIN_IMAGE, PIN_SIZE, alpha=True)
+    label_font()
+
+
+# Reads the user location and results of one line of input, searching for the nearest canteens if no results were given.
+# Returns (userLocation, results, routes). Raises ValueError if the line is not a valid request.
+def read_render_request(request, catalog):
+    if not isinstance(request, dict):
+        raise ValueError("Each line must be a JSON object")
+    try:
+        userLocation = (float(request["x"]), float(request["y"]))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("x and y must be numbers")
+    if not all(isfinite(coordinate) for coordinate in userLocation):
+        raise ValueError("x and y must be finite numbers")
+
+    if "results" in request:
+        try:
+            results = [(str(canteen), float(distance)) for canteen, distance in request["results"]]
+        except (TypeError, ValueError):
+            raise ValueError("results must be a list of [canteen, distance] pairs")
+        if not all(isfinite(distance) for canteen, distance in results):
+            raise ValueError("Distances must be finite numbers")
+        unknown = [canteen for canteen, distance in results if canteen not in catalog.locations]
+        if unknown:
+            raise ValueError("Unknown canteen {}".format(unknown[0]))
+        return (userLocation, results, None)
+
+    numOfCanteens = request.get("k", 1)
+    if isinstance(numOfCanteens, bool) or not isinstance(numOfCanteens, int) or numOfCanteens < 1:
+        raise ValueError("k must be a positive whole number")
+    if request.get("walking"):
+        found = query_walking(userLocation, numOfCanteens, catalog)
+        if found is None:
+            raise ValueError("There is no path graph to search by walking distance")
+        routes = {canteen.canteen: walking_route(userLocation, canteen.canteen, catalog) for canteen in found.canteens}
+        return (userLocation, [(canteen.canteen, canteen.distance) for canteen in found.canteens], routes)
+    found = query_nearest(userLocation, numOfCanteens, catalog)
+    return (userLocation, [(canteen.canteen, canteen.distance) for canteen in found.canteens], None)
+
+
+# Renders the map of one line of input into the output folder and returns the line of JSON output (without the newline)
+def render_line(numberedLine):
+    lineNumber, line, outputDirectory = numberedLine
+    try:
+        request = json.loads(line)
+    except (ValueError, RecursionError):
+        return json.dumps({"error": "Line is not valid JSON"})
+
+    answer = {}
+    if isinstance(request, dict) and "id" in request:
+        answer["id"] = request["id"]
+    try:
+        userLocation, results, routes = read_render_request(request, get_catalog(_dataLocation))
+    except ValueError as error:
+        answer["error"] = str(error)
+        return json.dumps(answer)
+    except Exception as error:
+        answer["error"] = "Internal error: {}: {}".format(type(error).__name__, error)
+        return json.dumps(answer)
+
+    # A map that fails to render is reported on its own line, the rest of the batch carries on
+    path = os.path.join(outputDirectory, "{}.png".format(lineNumber))
+    try:
+        png = render_nearest_canteens(userLocation, results, routes, _dataLocation)
+        with open(path, "wb") as pngFile:
+            pngFile.write(png)
+    except Exception as error:
+        answer["error"] = "Could not render the map: {}: {}".format(type(error).__name__, error)
+        return json.dumps(answer)
+    answer["file"] = path
+    return json.dumps(answer)
+
+
+# Streams render requests from input, writing the maps to outputDirectory and one JSON line per map to output, like
+# batch_search.run_batch: lines are read in windows of windowSize and each window is spread over the pool's workers.
+# Returns the number of lines answered.
+def run_render_batch(inputFile, outputFile, outputDirectory, data_location="canteens.xlsx", workers=1, windowSize=256):
+    os.makedirs(outputDirectory, exist_ok=True)
+    init_worker(data_location)
+    pool = Pool(workers, initializer=init_worker, initargs=(data_location,)) if workers > 1 else None
+    numOfLines = 0
+    try:
+        lines = ((lineNumber, line, outputDirectory) for lineNumber, line in enumerate((line for line in inputFile if line.strip()), 1))
+        while True:
+            window = list(islice(lines, windowSize))
+            if not window:
+                break
+            if pool is None:
+                answers = [render_line(numberedLine) for numberedLine in window]
+            else:
+                answers = pool.map(render_line, window, chunksize=max(1, len(window) // (workers * 4)))
+            outputFile.write("\n".join(answers) + "\n")
+            outputFile.flush()
+            numOfLines += len(window)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return numOfLines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render nearest canteen maps to PNG files, one per JSON line on stdin.")
+    parser.add_argument("--data", default="canteens.xlsx", help="canteen dataset to search (default: canteens.xlsx)")
+    parser.add_argument("--out", default="maps", help="folder to write the maps to (default: maps)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1, no pool)")
+    parser.add_argument("--window", type=int, default=256, help="number of maps read and rendered at a time (default: 256)")
+    arguments = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    numOfLines = run_render_batch(sys.stdin, sys.stdout, arguments.out, arguments.data, max(1, arguments.workers), max(1, arguments.window))
+    elapsed = time.perf_counter() - start
+
+    # Throughput goes to stderr so it does not mix with the results
+    print("Answered {} requests in {:.3f}s ({:.1f} requests/s)".format(numOfLines, elapsed, numOfLines / elapsed if elapsed > 0 else 0), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
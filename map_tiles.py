@@ -0,0 +1,259 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+
+import pygame
+
+from instrumentation import timed
+from map_assets import decode_image, hash_image
+from nearest_raster import MAP_SIZE
+
+# The campus map as a tile pyramid, so the map windows can zoom in on more detail than fits in the window.
+# Level k is the map at 2^k times the size of level 0 (MAP_SIZE, the size of the map windows), up to the resolution of the image.
+# Map coordinates, which canteen locations are given in, are pixels of level 0, so a location is at (x * 2^k, y * 2^k) on level k.
+# Each level is cut into TILE_SIZE x TILE_SIZE tiles of raw RGB pixels, and all of them are kept in one file next to the image
+# (e.g. NTUcampus.jpg -> NTUcampus.tiles). The file is memory-mapped and tiles are used straight from it without decoding,
+# so only the tiles on screen are ever read, however big the map is.
+# The file is made the first time a map window opens and again whenever the image changes, or ahead of time with
+#   python map_tiles.py [--image NTUcampus.jpg]
+
+TILE_SIZE = 256
+
+TILES_MAGIC = b"MAPTILES"
+
+# Pixels moved by one press of an arrow key
+PAN_STEP = 64
+
+# Pyramids opened by this process, by image path. They stay open, since tiles in use point into the mapped file.
+_openPyramids = {}
+
+
+# Returns where the tile pyramid of an image is kept, e.g. NTUcampus.jpg -> NTUcampus.tiles
+def tiles_location(image_location):
+    return os.path.splitext(os.path.abspath(image_location))[0] + ".tiles"
+
+
+# A pyramid opened from its file. levels[k] is (width, height, columns, rows, offset) of level k, whose tiles are stored row
+# by row from offset, every tile padded to TILE_SIZE x TILE_SIZE.
+class MapPyramid:
+    def __init__(self, path):
+        with open(path, "rb") as tilesFile:
+            if tilesFile.read(len(TILES_MAGIC)) != TILES_MAGIC:
+                raise ValueError("{} is not a map tile pyramid".format(path))
+            self.headerSize, = struct.unpack("<I", tilesFile.read(4))
+            self.header = json.loads(tilesFile.read(self.headerSize).decode("utf-8"))
+            header = self.header
+            self.source = header["source"]
+            # (mtime in ns, size) of the image when the pyramid was made, so an unchanged image does not have to be hashed again
+            self.sourceVersion = header.get("sourceVersion")
+            self.mapSize = tuple(header["mapSize"])
+            self.tileSize = header["tileSize"]
+            self.levels = [tuple(level) for level in header["levels"]]
+            self.mapped = mmap.mmap(tilesFile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.pixels = memoryview(self.mapped)
+
+    # Returns the tile at (column, row) of a level as a surface that reads its pixels from the file
+    def tile(self, level, column, row):
+        width, height, columns, rows, offset = self.levels[level]
+        tileBytes = self.tileSize * self.tileSize * 3
+        start = offset + (row * columns + column) * tileBytes
+        return pygame.image.frombuffer(self.pixels[start:start + tileBytes], (self.tileSize, self.tileSize), "RGB")
+
+
+# Works out the tile pyramid of an image for a map of mapSize (the size of level 0) and writes it to path
+@timed("build_pyramid")
+def build_pyramid(image_location, path, mapSize=MAP_SIZE, sourceHash=None):
+    sourceVersion = image_version(image_location)
+    if sourceHash is None:
+        sourceHash = hash_image(image_location)
+    decoded = decode_image(image_location, "RGB")
+
+    # Level 0 always exists, each level after it doubles the size for as long as the image has the detail for it
+    levelSizes = [tuple(mapSize)]
+    while levelSizes[-1][0] * 2 <= decoded.get_width() and levelSizes[-1][1] * 2 <= decoded.get_height():
+        levelSizes.append((levelSizes[-1][0] * 2, levelSizes[-1][1] * 2))
+
+    levels = []
+    offset = 0
+    for width, height in levelSizes:
+        columns, rows = -(-width // TILE_SIZE), -(-height // TILE_SIZE)
+        levels.append([width, height, columns, rows, offset])
+        offset += columns * rows * TILE_SIZE * TILE_SIZE * 3
+
+    # The tiles start on an 8 byte boundary after the header, so the offsets of the levels are counted from there
+    header = {"source": sourceHash, "sourceVersion": sourceVersion, "mapSize": list(mapSize), "tileSize": TILE_SIZE, "levels": levels}
+    headerBytes = json.dumps(header).encode("utf-8")
+    start = len(TILES_MAGIC) + 4 + len(headerBytes) + 16 * len(levels) + 32
+    start += -start % 8
+    for level in levels:
+        level[4] += start
+    headerBytes = json.dumps(header).encode("utf-8").ljust(start - len(TILES_MAGIC) - 4)
+
+    # Write to a temporary file first and move it into place, so readers never see a half written pyramid
+    temporaryPath = "{}.{}.tmp".format(path, os.getpid())
+    tile = pygame.Surface((TILE_SIZE, TILE_SIZE), depth=24)
+    with open(temporaryPath, "wb") as tilesFile:
+        tilesFile.write(TILES_MAGIC + struct.pack("<I", len(headerBytes)) + headerBytes)
+        for width, height, columns, rows, levelOffset in levels:
+            # Level 0 is scaled like map_assets.load_image scales the map, so both show the same pixels
+            scaled = pygame.transform.smoothscale(decoded, (width, height))
+            for row in range(rows):
+                for column in range(columns):
+                    tile.fill((0, 0, 0))
+                    tile.blit(scaled, (0, 0), (column * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE))
+                    tilesFile.write(pygame.image.tobytes(tile, "RGB"))
+    os.replace(temporaryPath, path)
+
+
+# Records a new (mtime, size) of an image that was found unchanged, in the open pyramid and in the header of its file if it fits
+# in the header's padding (the tiles are not touched)
+def record_source_version(path, pyramid, sourceVersion):
+    pyramid.sourceVersion = sourceVersion
+    headerBytes = json.dumps(dict(pyramid.header, sourceVersion=sourceVersion)).encode("utf-8")
+    if len(headerBytes) <= pyramid.headerSize:
+        try:
+            with open(path, "r+b") as tilesFile:
+                tilesFile.seek(len(TILES_MAGIC) + 4)
+                tilesFile.write(headerBytes.ljust(pyramid.headerSize))
+        except OSError:
+            pass
+
+
+# Returns the (mtime in ns, size) of an image, which changes whenever the image is edited
+def image_version(image_location):
+    imageStat = os.stat(image_location)
+    return [imageStat.st_mtime_ns, imageStat.st_size]
+
+
+# Returns the tile pyramid of an image for a map of mapSize, making it first if there is none yet for this version of the image.
+# Like the catalog snapshot, the image is only hashed when its mtime or size differ from when the pyramid was made.
+@timed("open_pyramid")
+def open_pyramid(image_location, mapSize=MAP_SIZE):
+    key = os.path.abspath(image_location)
+    sourceVersion = image_version(image_location)
+    pyramid = _openPyramids.get(key)
+    if pyramid is not None and pyramid.sourceVersion == sourceVersion and pyramid.mapSize == tuple(mapSize):
+        return pyramid
+
+    path = tiles_location(image_location)
+    try:
+        pyramid = MapPyramid(path)
+    except (OSError, ValueError, KeyError, struct.error):
+        pyramid = None
+    if pyramid is None or pyramid.mapSize != tuple(mapSize) or pyramid.sourceVersion != sourceVersion:
+        sourceHash = hash_image(image_location)
+        if pyramid is None or pyramid.source != sourceHash or pyramid.mapSize != tuple(mapSize):
+            build_pyramid(image_location, path, mapSize, sourceHash)
+            pyramid = MapPyramid(path)
+        # The image was touched but not changed, so later opens can skip the hash
+        record_source_version(path, pyramid, sourceVersion)
+    _openPyramids[key] = pyramid
+    return pyramid
+
+
+# The part of a pyramid shown in a window: a zoom level, and the position of the window's top left corner on that level
+class MapView:
+    def __init__(self, pyramid, viewSize):
+        self.pyramid = pyramid
+        self.viewSize = tuple(viewSize)
+        self.level = 0
+        self.left = 0
+        self.top = 0
+
+    # Pixels of the window per unit of map coordinates
+    @property
+    def scale(self):
+        return 1 << self.level
+
+    # Returns where a location in map coordinates is in the window
+    def to_screen(self, location):
+        return (location[0] * self.scale - self.left, location[1] * self.scale - self.top)
+
+    # Returns the location in map coordinates of a position in the window (whole numbers when not zoomed in)
+    def to_map(self, position):
+        x, y = (position[0] + self.left) / self.scale, (position[1] + self.top) / self.scale
+        return (int(x) if x == int(x) else x, int(y) if y == int(y) else y)
+
+    # Keeps the window inside the map
+    def clamp(self):
+        width, height = self.pyramid.levels[self.level][:2]
+        self.left = max(0, min(self.left, width - self.viewSize[0]))
+        self.top = max(0, min(self.top, height - self.viewSize[1]))
+
+    # Zooms in (steps > 0) or out (steps < 0) by powers of two, keeping the location under a position in the window where it is.
+    # Returns True if the view changed.
+    def zoom(self, steps, position):
+        level = max(0, min(self.level + steps, len(self.pyramid.levels) - 1))
+        if level == self.level:
+            return False
+        x, y = self.to_map(position)
+        self.level = level
+        self.left = int(x * self.scale - position[0])
+        self.top = int(y * self.scale - position[1])
+        self.clamp()
+        return True
+
+    # Moves the window over the map by (dx, dy) pixels. Returns True if the view changed.
+    def pan(self, dx, dy):
+        before = (self.left, self.top)
+        self.left += int(dx)
+        self.top += int(dy)
+        self.clamp()
+        return (self.left, self.top) != before
+
+    # Draws the tiles in view onto a surface the size of the window
+    def draw(self, surface):
+        tileSize = self.pyramid.tileSize
+        width, height, columns, rows, offset = self.pyramid.levels[self.level]
+        for row in range(self.top // tileSize, min(rows, -(-(self.top + self.viewSize[1]) // tileSize))):
+            for column in range(self.left // tileSize, min(columns, -(-(self.left + self.viewSize[0]) // tileSize))):
+                surface.blit(self.pyramid.tile(self.level, column, row), (column * tileSize - self.left, row * tileSize - self.top))
+
+    # Draws the part in view of an overlay the size of level 0 (e.g. the canteen coverage map), scaled up to the zoom level
+    def draw_overlay(self, surface, overlay):
+        scale = self.scale
+        left, top = self.left // scale, self.top // scale
+        right = min(overlay.get_width(), -(-(self.left + self.viewSize[0]) // scale))
+        bottom = min(overlay.get_height(), -(-(self.top + self.viewSize[1]) // scale))
+        visible = overlay.subsurface((left, top, right - left, bottom - top))
+        if scale > 1:
+            visible = pygame.transform.scale(visible, ((right - left) * scale, (bottom - top) * scale))
+        surface.blit(visible, (left * scale - self.left, top * scale - self.top))
+
+    # Handles the zoom and pan controls of a map window: the mouse wheel or +/- to zoom, dragging with the right (or middle)
+    # mouse button or the arrow keys to pan. Returns True if the view changed and the window needs to be drawn again.
+    def handle_event(self, event):
+        if event.type == pygame.MOUSEWHEEL and event.y:
+            return self.zoom(1 if event.y > 0 else -1, pygame.mouse.get_pos())
+        if event.type == pygame.MOUSEMOTION and (event.buttons[1] or event.buttons[2]):
+            return self.pan(-event.rel[0], -event.rel[1])
+        if event.type == pygame.KEYDOWN:
+            centre = (self.viewSize[0] // 2, self.viewSize[1] // 2)
+            if event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+                return self.zoom(1, centre)
+            if event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                return self.zoom(-1, centre)
+            moves = {pygame.K_LEFT: (-PAN_STEP, 0), pygame.K_RIGHT: (PAN_STEP, 0), pygame.K_UP: (0, -PAN_STEP), pygame.K_DOWN: (0, PAN_STEP)}
+            if event.key in moves:
+                return self.pan(*moves[event.key])
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cut the campus map into a memory-mapped tile pyramid for zooming in the map windows.")
+    parser.add_argument("--image", default="NTUcampus.jpg", help="map image (default: NTUcampus.jpg)")
+    arguments = parser.parse_args(argv)
+
+    path = tiles_location(arguments.image)
+    build_pyramid(arguments.image, path)
+    pyramid = MapPyramid(path)
+    print("Wrote {} zoom level(s) of {} to {} ({} bytes)".format(
+        len(pyramid.levels), arguments.image, path, os.path.getsize(path)))
+    for level, (width, height, columns, rows, offset) in enumerate(pyramid.levels):
+        print("  level {}: {} x {} pixels, {} x {} tiles".format(level, width, height, columns, rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+# Precomputed nearest canteens for every pixel of the campus map.
+# Location searches come from clicks on the 620 x 750 map, so there are only ~465k possible locations. The raster stores,
+# for each of them, the ids of the nearest canteens in order (ids are positions in catalog.canteens), so a click is answered
+# with one read from a memory-mapped file instead of a search. The nearest canteen of each pixel also makes a coverage map.
+#   python nearest_raster.py [--data canteens.xlsx] [--depth 16]
+# The raster is optional: it is only used once it has been generated for a dataset, and it is generated again by itself
+# whenever the canteens or their coordinates change.
+
+# Size of the campus map in pixels (width, height)
+MAP_SIZE = (620, 750)
+
+# Number of nearest canteens stored per pixel, unless asked otherwise. Searches for more canteens than this use the spatial index.
+DEFAULT_DEPTH = 16
+
+RASTER_MAGIC = b"NNRASTER"
+
+# Colours of the coverage map, canteen i gets COVERAGE_COLOURS[i % len(COVERAGE_COLOURS)]
+COVERAGE_COLOURS = [(230, 25, 75), (60, 180, 75), (255, 225, 25), (0, 130, 200), (245, 130, 48), (145, 30, 180),
+                    (70, 240, 240), (240, 50, 230), (210, 245, 60), (250, 190, 212), (0, 128, 128), (170, 110, 40)]
+
+# Smallest type that holds the canteen ids of a raster, by the number of canteens: (most canteens, array typecode, NumPy dtype)
+ID_TYPES = [(0x100, "B", "<u1"), (0x10000, "H", "<u2"), (0x100000000, "I", "<u4")]
+
+# Pixels are worked out this many rows of the map at a time, which bounds the memory used while building
+ROWS_PER_CHUNK = 64
+
+
+# Returns where the raster of a dataset is kept, e.g. canteens.xlsx -> canteens.nearest.raster
+def raster_location(data_location):
+    return os.path.splitext(os.path.abspath(data_location))[0] + ".nearest.raster"
+
+
+# Returns a hash of what a raster depends on: the map size, the depth, and every canteen with its coordinates in id order
+def canteen_key(catalog, mapSize, depth):
+    canteens = [[canteen, *catalog.locations[canteen]] for canteen in catalog.canteens]
+    return hashlib.sha256(json.dumps([list(mapSize), depth, canteens]).encode("utf-8")).hexdigest()
+
+
+# A raster opened from its file. ids[(y * width + x) * depth + i] is the id of the (i + 1)-th nearest canteen of pixel (x, y).
+class NearestRaster:
+    def __init__(self, path):
+        with open(path, "rb") as rasterFile:
+            if rasterFile.read(len(RASTER_MAGIC)) != RASTER_MAGIC:
+                raise ValueError("{} is not a nearest canteen raster".format(path))
+            headerSize, = struct.unpack("<I", rasterFile.read(4))
+            header = json.loads(rasterFile.read(headerSize).decode("utf-8"))
+            self.key = header["key"]
+            self.width, self.height = header["mapSize"]
+            self.depth = header["depth"]
+            # The depth asked for when building, the raster holds fewer canteens if the dataset has fewer
+            self.requestedDepth = header["requestedDepth"]
+            self.typecode = header["typecode"]
+            self.mapped = mmap.mmap(rasterFile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.ids = memoryview(self.mapped)[header["offset"]:].cast(self.typecode)
+
+    # Returns the ids of the k canteens nearest to a location, nearest first, or None if the raster does not cover it
+    # (the location is not a pixel of the map, or more canteens were asked for than the raster holds)
+    def nearest(self, location, k):
+        x, y = location
+        if not (0 <= x < self.width and 0 <= y < self.height and x == int(x) and y == int(y) and k <= self.depth):
+            return None
+        start = (int(y) * self.width + int(x)) * self.depth
+        return self.ids[start:start + k].tolist()
+
+    # Returns the id of the nearest canteen of every pixel, row by row
+    def nearest_plane(self):
+        return self.ids[::self.depth].tolist() if self.depth else []
+
+    # Returns the coverage map as RGBA bytes (row by row, 4 bytes per pixel): every pixel gets the colour of its nearest
+    # canteen, colours[canteenId % len(colours)] (up to 256 colours), with the given alpha, e.g. to be drawn over the map
+    # with pygame.image.frombuffer
+    def coverage_rgba(self, colours, alpha=96):
+        numOfColours = len(colours)
+        plane = self.ids[::self.depth]
+        # The colour number of every pixel, one byte each
+        if self.typecode == "B":
+            colourIds = plane.tobytes().translate(bytes(canteenId % numOfColours for canteenId in range(256)))
+        else:
+            colourIds = bytes(canteenId % numOfColours for canteenId in plane.tolist())
+        rgba = bytearray(len(colourIds) * 4)
+        for channel in range(3):
+            rgba[channel::4] = colourIds.translate(bytes(colour[channel] for colour in colours).ljust(256, b"\0"))
+        rgba[3::4] = bytes([alpha]) * len(colourIds)
+        return bytes(rgba)
+
+    def close(self):
+        self.ids.release()
+        self.mapped.close()
+
+
+# Works out the raster of a catalog and writes it to path. Needs NumPy (only for building, not for reading the raster).
+def build_raster(catalog, path, mapSize=MAP_SIZE, depth=DEFAULT_DEPTH):
+    import numpy as np
+
+    width, height = mapSize
+    requestedDepth = depth
+    depth = max(0, min(depth, len(catalog.canteens)))
+    idTypes = [(typecode, dtype) for mostCanteens, typecode, dtype in ID_TYPES if len(catalog.canteens) <= mostCanteens]
+    if not idTypes:
+        raise ValueError("A raster can hold at most {} canteens".format(ID_TYPES[-1][0]))
+    typecode, dtype = idTypes[0]
+    header = {"key": canteen_key(catalog, mapSize, depth), "mapSize": [width, height], "depth": depth,
+              "requestedDepth": requestedDepth, "typecode": typecode}
+
+    # The pixel data starts on an 8 byte boundary after the header
+    headerBytes = json.dumps(header).encode("utf-8")
+    offset = len(RASTER_MAGIC) + 4 + len(headerBytes) + 32
+    offset += -offset % 8
+    header["offset"] = offset
+    headerBytes = json.dumps(header).encode("utf-8").ljust(offset - len(RASTER_MAGIC) - 4)
+
+    # Write to a temporary file first and move it into place, so readers never see a half written raster
+    temporaryPath = "{}.{}.tmp".format(path, os.getpid())
+    with open(temporaryPath, "wb") as rasterFile:
+        rasterFile.write(RASTER_MAGIC + struct.pack("<I", len(headerBytes)) + headerBytes)
+        xs = np.arange(width, dtype=np.float64)
+        for top in range(0, height, ROWS_PER_CHUNK):
+            ys = np.arange(top, min(height, top + ROWS_PER_CHUNK), dtype=np.float64)
+            points = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+            canteenIds, distances = catalog.spatialIndex.nearest_batch(points, depth)
+            rasterFile.write(canteenIds.astype(dtype).tobytes())
+    os.replace(temporaryPath, path)
+
+
+# Opens the raster at path for a catalog, or returns None if no raster was generated there.
+# A raster left over from other canteens (or coordinates) is generated again first, with the same depth.
+def open_raster(catalog, path):
+    if not os.path.exists(path):
+        return None
+    raster = NearestRaster(path)
+    mapSize = (raster.width, raster.height)
+    if raster.key != canteen_key(catalog, mapSize, max(0, min(raster.requestedDepth, len(catalog.canteens)))):
+        raster.close()
+        build_raster(catalog, path, mapSize, raster.requestedDepth)
+        raster = NearestRaster(path)
+    return raster
+
+
+def main(argv=None):
+    # The catalog is only needed to build a raster, not to read one
+    from catalog import get_catalog
+
+    parser = argparse.ArgumentParser(description="Precompute the nearest canteens of every pixel of the campus map.")
+    parser.add_argument("--data", default="canteens.xlsx", help="canteen dataset (default: canteens.xlsx)")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="nearest canteens stored per pixel (default: {})".format(DEFAULT_DEPTH))
+    arguments = parser.parse_args(argv)
+
+    catalog = get_catalog(arguments.data)
+    path = raster_location(arguments.data)
+    build_raster(catalog, path, MAP_SIZE, arguments.depth)
+    raster = NearestRaster(path)
+    print("Wrote the {} nearest canteen(s) of {} x {} pixels to {} ({} bytes)".format(
+        raster.depth, raster.width, raster.height, path, os.path.getsize(path)))
+
+
+if __name__ == "__main__":
+    main()
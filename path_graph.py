@@ -0,0 +1,161 @@
+import json
+import os
+from array import array
+from heapq import heappop, heappush, nsmallest
+from math import inf, sqrt
+
+from search_index import SpatialIndex
+
+# Walking distances along the campus paths, instead of straight lines across the map.
+# The paths are an optional data file next to the dataset (canteens.xlsx -> canteens.paths.json), in map coordinates:
+#   {"nodes": [[x, y], ...], "edges": [[a, b], [a, b, length], ...]}
+# Nodes are points on the walkways, and edges join two of them (by position in "nodes") in both directions. An edge is as long
+# as the straight line between its nodes unless a length is given, e.g. for stairs or a steep slope.
+# Canteens and users join the paths at their few nearest nodes, walking there in a straight line.
+# A Dijkstra search is run once per canteen when the paths are loaded, and the resulting distance fields (the walking distance
+# from every node to the canteen) are kept, so a search only adds the walk to the paths and picks the k nearest canteens.
+
+# Number of nearest path nodes a location can join the paths at
+ENTRY_NODES = 3
+
+# Path graph files that could not be read, by path: ((mtime, size) of the file, the error). A broken file is only read again
+# once it is edited, rather than on every search.
+_brokenPathFiles = {}
+
+
+# Returns where the path graph of a dataset is kept, e.g. canteens.xlsx -> canteens.paths.json
+def paths_location(data_location):
+    return os.path.splitext(os.path.abspath(data_location))[0] + ".paths.json"
+
+
+# Reads a path graph file and returns (nodes, edges), nodes as (x, y) and edges as (a, b, length).
+# Raises ValueError if the file is malformed.
+def read_path_graph(path):
+    with open(path, encoding="utf-8") as pathsFile:
+        graph = json.load(pathsFile)
+    try:
+        nodes = [(x, y) for x, y in graph["nodes"]]
+        if not all(isinstance(coordinate, (int, float)) and not isinstance(coordinate, bool) for node in nodes for coordinate in node):
+            raise ValueError("Node coordinates must be numbers")
+        edges = []
+        for edge in graph["edges"]:
+            a, b = int(edge[0]), int(edge[1])
+            if not (0 <= a < len(nodes) and 0 <= b < len(nodes)):
+                raise ValueError("Edge {} joins a node that does not exist".format(edge))
+            length = float(edge[2]) if len(edge) > 2 else sqrt((nodes[a][0] - nodes[b][0])**2 + (nodes[a][1] - nodes[b][1])**2)
+            if not (length >= 0):
+                raise ValueError("Edge {} has a negative length".format(edge))
+            edges.append((a, b, length))
+    except (KeyError, TypeError, IndexError, ValueError) as error:
+        raise ValueError("{} is not a valid path graph: {}".format(path, error))
+    return (nodes, edges)
+
+
+class WalkingIndex:
+    def __init__(self, catalog, path):
+        self.path = path
+        fileStat = os.stat(path)
+        self.fileVersion = (fileStat.st_mtime_ns, fileStat.st_size)
+
+        nodes, edges = read_path_graph(path)
+        self.nodes = nodes
+        self.neighbours = [[] for node in nodes]
+        for a, b, length in edges:
+            self.neighbours[a].append((b, length))
+            self.neighbours[b].append((a, length))
+        self.nodeIndex = SpatialIndex(points=nodes)
+
+        # distances[canteenId][node] = walking distance from the node to the canteen (inf if it cannot be reached),
+        # towards[canteenId][node] = the next node on that walk (-1 where the walk leaves the paths for the canteen)
+        self.canteenLocations = [catalog.locations[canteen] for canteen in catalog.canteens]
+        self.distances = []
+        self.towards = []
+        for location in self.canteenLocations:
+            distances, towards = self.distance_field(location)
+            self.distances.append(distances)
+            self.towards.append(towards)
+
+    # Returns the path nodes a location joins the paths at, as (node, straight line distance) pairs
+    def entry_nodes(self, location):
+        return self.nodeIndex.nearest(location, ENTRY_NODES)
+
+    # Runs Dijkstra from a location (starting at all of its entry nodes at once) and returns the distance to every node
+    # and the next node on the way back to the location
+    def distance_field(self, location):
+        distances = array("d", [inf]) * len(self.nodes)
+        towards = array("l", [-1]) * len(self.nodes)
+        queue = []
+        for node, distance in self.entry_nodes(location):
+            distances[node] = distance
+            heappush(queue, (distance, node))
+        while queue:
+            distance, node = heappop(queue)
+            if distance > distances[node]:
+                continue
+            for neighbour, length in self.neighbours[node]:
+                if distance + length < distances[neighbour]:
+                    distances[neighbour] = distance + length
+                    towards[neighbour] = node
+                    heappush(queue, (distance + length, neighbour))
+        return (distances, towards)
+
+    # Returns the walking distance from a location to a canteen, and the node the walk joins the paths at
+    # (None if walking straight there is shortest, which is only allowed when the canteen is nearer than any path).
+    # entries are the location's entry nodes, so they can be looked up once for many canteens.
+    def walk(self, location, canteenId, entries=None):
+        if entries is None:
+            entries = self.entry_nodes(location)
+        x, y = location
+        canteenX, canteenY = self.canteenLocations[canteenId]
+        best = (sqrt((x - canteenX)**2 + (y - canteenY)**2), None)
+        if entries and best[0] > entries[0][1]:
+            best = (inf, None)
+        for node, distance in entries:
+            if distance + self.distances[canteenId][node] < best[0]:
+                best = (distance + self.distances[canteenId][node], node)
+        return best
+
+    # Returns the k canteens nearest to a location by walking distance as (canteen id, distance), nearest first,
+    # ties going to the canteen listed first. Canteens that cannot be reached along the paths are left out.
+    def nearest(self, location, k):
+        entries = self.entry_nodes(location)
+        walks = ((self.walk(location, canteenId, entries)[0], canteenId) for canteenId in range(len(self.canteenLocations)))
+        return [(canteenId, distance) for distance, canteenId in nsmallest(k, walks) if distance < inf]
+
+    # Returns the walk from a location to a canteen as a list of (x, y) points, from the location to the canteen
+    def route(self, location, canteenId):
+        distance, node = self.walk(location, canteenId)
+        points = [tuple(location)]
+        while node is not None:
+            points.append(self.nodes[node])
+            node = self.towards[canteenId][node]
+            if node == -1:
+                node = None
+        points.append(self.canteenLocations[canteenId])
+        return points
+
+    # Returns True if the path graph file has not changed since it was loaded
+    def is_current(self):
+        try:
+            fileStat = os.stat(self.path)
+        except OSError:
+            return False
+        return (fileStat.st_mtime_ns, fileStat.st_size) == self.fileVersion
+
+
+# Loads the walking index of a catalog from a path graph file, or returns None if there is no such file.
+# Raises ValueError if the file is malformed.
+def open_walking_index(catalog, path):
+    try:
+        fileStat = os.stat(path)
+    except OSError:
+        return None
+    fileVersion = (fileStat.st_mtime_ns, fileStat.st_size)
+    broken = _brokenPathFiles.get(path)
+    if broken is not None and broken[0] == fileVersion:
+        raise broken[1]
+    try:
+        return WalkingIndex(catalog, path)
+    except ValueError as error:
+        _brokenPathFiles[path] = (fileVersion, error)
+        raise
@@ -0,0 +1,502 @@
+import re # For string slicing stuff (used in natural sort function)
+import threading
+from collections import OrderedDict, namedtuple
+from math import inf, isfinite, sqrt
+
+from catalog import get_catalog
+from instrumentation import count, timed
+from keyword_query import QuerySyntaxError, Term, is_boolean_query, matching_texts, parse_keyword_query, query_text, search_query
+from search_index import squared_distance
+
+# Non-interactive query layer. These functions never print or wait for input, they only return result objects,
+# so they can be called from the menu in assignment.py as well as from services, batch jobs and benchmarks.
+
+# A stall found by a search
+StallMatch = namedtuple("StallMatch", ["canteen", "stall", "price", "keywords"])
+
+# A canteen found by a location search, with its (x, y) location and distance from the user
+CanteenDistance = namedtuple("CanteenDistance", ["canteen", "location", "distance"])
+
+# Results are shared through the query cache, so their lists of stalls and canteens are tuples and must not be changed.
+
+# Result of a keyword search. Stalls are listed by canteen (in natural order) and then by stall name.
+# If no stall matched, suggestion holds the closest known keyword (or None if nothing is close enough).
+KeywordResult = namedtuple("KeywordResult", ["searchTerm", "stalls", "suggestion"])
+
+# Result of a price search, stalls listed by canteen (in natural order) and then by stall name
+PriceResult = namedtuple("PriceResult", ["minPrice", "maxPrice", "stalls"])
+
+# Result of a location search, canteens listed nearest first
+NearestResult = namedtuple("NearestResult", ["userLocation", "canteens"])
+
+# A stall found by a combined search, with the distance from the user to its canteen (None if no location was given)
+RankedStall = namedtuple("RankedStall", ["canteen", "stall", "price", "keywords", "distance"])
+
+# Result of a combined search: the search as it was given (None for what was left out), the stalls ranked best first,
+# and the plan it was run with (the index the stalls were read from, then the filters checked on them in order)
+CombinedResult = namedtuple("CombinedResult", ["keyword", "minPrice", "maxPrice", "userLocation", "numOfCanteens", "radius", "stalls", "plan"])
+
+
+# Raised when a query is well formed but cannot be answered, e.g. a walking search for a dataset without a path graph
+class QueryError(ValueError):
+    pass
+
+
+# Bounded LRU cache of query results, shared by every query made in this process.
+# Entries belong to one catalog: when the catalog (or the version of its data) changes, the whole cache is dropped.
+# A maxSize of 0 turns caching off.
+class QueryCache:
+    def __init__(self, maxSize=4096, cellSize=8):
+        self.maxSize = maxSize
+        # Location searches are cached per cellSize x cellSize block of the map, so nearby clicks share an entry
+        self.cellSize = cellSize
+        self.entries = OrderedDict()
+        # Queries can run on several threads at once (e.g. in search_server.py)
+        self.lock = threading.Lock()
+        self.catalog = None
+        self.dataVersion = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    # Returns the cached value for key, or works it out with compute() and caches it
+    def get(self, catalog, key, compute):
+        if self.maxSize <= 0:
+            return compute()
+
+        # The lock is only held while the entries are looked up or changed, not while a value is worked out
+        with self.lock:
+            # The data changed (e.g. the workbook was reloaded), so nothing cached so far can be trusted
+            if catalog is not self.catalog or catalog.version != self.dataVersion:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.catalog = catalog
+                self.dataVersion = catalog.version
+
+            if key in self.entries:
+                self.hits += 1
+                count("cache.hit")
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+            self.misses += 1
+        count("cache.miss")
+        value = compute()
+        with self.lock:
+            # Not kept if another thread moved the cache on to newer data in the meantime
+            if catalog is self.catalog and catalog.version == self.dataVersion:
+                self.entries[key] = value
+                while len(self.entries) > self.maxSize:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # Returns the cache counters, ready to be sent as JSON
+    def stats(self):
+        return {"size": len(self.entries), "maxSize": self.maxSize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
+
+# The cache used by query_keyword, query_price and query_nearest
+queryCache = QueryCache()
+
+
+# Finds the stalls whose keywords match a search term (case-insensitive).
+# The search term can also be a boolean query such as 'halal AND noodles NOT spicy' (see keyword_query.py), which raises
+# QuerySyntaxError if it is malformed. Suggestions are only made for single keywords and phrases.
+@timed("query_keyword", query=True)
+def query_keyword(keyword, catalog=None):
+    if catalog is None:
+        catalog = get_catalog()
+    if is_boolean_query(keyword):
+        query = parse_keyword_query(keyword)
+        if not isinstance(query, Term):
+            searchTerm = query_text(query)
+            return queryCache.get(catalog, ("keyword", searchTerm),
+                                  lambda: KeywordResult(searchTerm, group_by_canteen(catalog, search_query(query, catalog.keywordIndex)), None))
+        keyword = query.text
+    searchTerm = keyword.lower()
+    return queryCache.get(catalog, ("keyword", searchTerm), lambda: search_keyword(catalog, searchTerm))
+
+
+@timed("search_keyword")
+def search_keyword(catalog, searchTerm):
+    stalls = group_by_canteen(catalog, catalog.keywordIndex.search(searchTerm))
+
+    # Nothing matched, we look for the closest known keyword to suggest instead
+    suggestion = None
+    if len(stalls) <= 0:
+        suggestions = catalog.suggestionIndex.suggest(searchTerm, n=1, cutoff=0.5)
+        if len(suggestions) >= 1:
+            suggestion = suggestions[0]
+
+    return KeywordResult(searchTerm, stalls, suggestion)
+
+
+# Finds the stalls priced within minPrice and maxPrice (inclusive)
+@timed("query_price", query=True)
+def query_price(minPrice, maxPrice, catalog=None):
+    if catalog is None:
+        catalog = get_catalog()
+    return queryCache.get(catalog, ("price", minPrice, maxPrice),
+                          lambda: PriceResult(minPrice, maxPrice, group_by_canteen(catalog, catalog.priceIndex.search(minPrice, maxPrice))))
+
+
+# Finds the numOfCanteens canteens nearest to the user's (x, y) location
+@timed("query_nearest", query=True)
+def query_nearest(userLocation, numOfCanteens, catalog=None):
+    if catalog is None:
+        catalog = get_catalog()
+    x, y = userLocation
+    if not (isfinite(x) and isfinite(y)):
+        raise ValueError("User location {} is not a finite point".format(userLocation))
+    k = max(0, min(numOfCanteens, len(catalog.canteens)))
+
+    # Clicks on the map are answered straight from the nearest canteen raster, if one was generated
+    raster = catalog.nearestRaster
+    canteenIds = None if raster is None else raster.nearest(userLocation, k)
+
+    # The cache holds, per block of the map, every canteen that could be among the k nearest to a point in that block.
+    # Only those few candidates are then ranked exactly for this location, so results are the same as without the cache.
+    cellSize = queryCache.cellSize
+    if canteenIds is not None:
+        nearest = []
+        for canteenId in canteenIds:
+            pointX, pointY = catalog.spatialIndex.pointX[canteenId], catalog.spatialIndex.pointY[canteenId]
+            nearest.append((canteenId, sqrt(squared_distance(x, y, pointX, pointY))))
+    elif queryCache.maxSize > 0 and cellSize > 0:
+        cellX, cellY = int(x // cellSize), int(y // cellSize)
+        candidates = queryCache.get(catalog, ("nearest", cellX, cellY, k), lambda: nearest_candidates(catalog, cellX, cellY, cellSize, k))
+        squaredDistances = []
+        for canteenId in candidates:
+            pointX, pointY = catalog.spatialIndex.pointX[canteenId], catalog.spatialIndex.pointY[canteenId]
+            squaredDistances.append((squared_distance(x, y, pointX, pointY), canteenId))
+        nearest = [(canteenId, sqrt(squaredDistance)) for squaredDistance, canteenId in sorted(squaredDistances)[:k]]
+    else:
+        nearest = catalog.spatialIndex.nearest(userLocation, k)
+
+    canteens = []
+    for canteenId, distance in nearest:
+        canteen = catalog.canteens[canteenId]
+        canteens.append(CanteenDistance(canteen, catalog.locations[canteen], distance))
+    return NearestResult(tuple(userLocation), tuple(canteens))
+
+
+# Finds the numOfCanteens canteens nearest to the user's (x, y) location by walking distance along the campus paths.
+# Canteens that cannot be reached along the paths are left out. Returns None if the dataset has no path graph (see path_graph.py).
+@timed("query_walking", query=True)
+def query_walking(userLocation, numOfCanteens, catalog=None):
+    if catalog is None:
+        catalog = get_catalog()
+    walkingIndex = current_walking_index(catalog)
+    if walkingIndex is None:
+        return None
+    k = max(0, min(numOfCanteens, len(catalog.canteens)))
+
+    def search():
+        canteens = []
+        for canteenId, distance in walkingIndex.nearest(userLocation, k):
+            canteen = catalog.canteens[canteenId]
+            canteens.append(CanteenDistance(canteen, catalog.locations[canteen], distance))
+        return NearestResult(tuple(userLocation), tuple(canteens))
+
+    # The paths can change without the dataset changing, so cached results are kept per version of the path graph
+    return queryCache.get(catalog, ("walking", walkingIndex.fileVersion, tuple(userLocation), k), search)
+
+
+# Returns the walk from the user's location to a canteen along the campus paths as a list of (x, y) points,
+# or None if the dataset has no path graph
+@timed("walking_route", query=True)
+def walking_route(userLocation, canteen, catalog=None):
+    if catalog is None:
+        catalog = get_catalog()
+    walkingIndex = current_walking_index(catalog)
+    if walkingIndex is None:
+        return None
+    return walkingIndex.route(userLocation, catalog.canteens.index(canteen))
+
+
+# Returns the catalog's walking index, loading the path graph again first if its file was edited since it was loaded.
+# Raises QueryError with the reason if the path graph file is malformed.
+def current_walking_index(catalog):
+    try:
+        walkingIndex = catalog.walkingIndex
+        if walkingIndex is not None and not walkingIndex.is_current():
+            # Another thread may have dropped the stale index already
+            catalog.__dict__.pop("walkingIndex", None)
+            walkingIndex = catalog.walkingIndex
+    except ValueError as error:
+        raise QueryError(str(error))
+    return walkingIndex
+
+
+# Returns the ids of every canteen that can be among the k nearest canteens to some point of a map cell.
+# If the k-th nearest canteen to the centre of the cell is d away, and any point of the cell is at most r from the centre,
+# then all k nearest canteens of any point in the cell are within d + 2r of the centre.
+def nearest_candidates(catalog, cellX, cellY, cellSize, k):
+    if k <= 0:
+        return ()
+    centre = ((cellX + 0.5) * cellSize, (cellY + 0.5) * cellSize)
+    kthDistance = catalog.spatialIndex.nearest(centre, k)[-1][1]
+    radius = kthDistance + cellSize * sqrt(2)
+    # A little slack so rounding can never leave out a canteen right on the edge
+    return tuple(catalog.spatialIndex.within(centre, radius * (1 + 1e-9) + 1e-9))
+
+
+# Finds the stalls matching any mix of a keyword (or boolean keyword query), a price range and a location, e.g. halal food
+# under S$5 within 300m. Any of the arguments can be left as None, but at least one of keyword, the price range or the
+# location must be given. With a location, stalls are ranked by the distance to their canteen, and can be limited to the
+# numOfCanteens nearest canteens with a matching stall and / or to canteens within radius. Otherwise they are ranked by price.
+# Raises QuerySyntaxError (a ValueError) if the search is missing what it needs.
+@timed("query_combined", query=True)
+def query_combined(keyword=None, minPrice=None, maxPrice=None, userLocation=None, numOfCanteens=None, radius=None, catalog=None):
+    if catalog is None:
+        catalog = get_catalog()
+    if keyword is None and minPrice is None and maxPrice is None and userLocation is None:
+        raise QuerySyntaxError("A combined search needs a keyword, a price range or a location")
+    if userLocation is None and (numOfCanteens is not None or radius is not None):
+        raise QuerySyntaxError("A number of canteens or a radius can only be given with a location")
+
+    # Boolean queries are cached under their standard form, like query_keyword does
+    query = None
+    if keyword is not None:
+        query = parse_keyword_query(keyword) if is_boolean_query(keyword) else Term(keyword.lower())
+        keyword = query_text(query)
+    if userLocation is not None:
+        userLocation = tuple(userLocation)
+    key = ("combined", keyword, minPrice, maxPrice, userLocation, numOfCanteens, radius)
+    return queryCache.get(catalog, key, lambda: CombinedSearch(catalog, query, minPrice, maxPrice, userLocation, numOfCanteens, radius).run(keyword))
+
+
+# Plans and runs one combined search.
+# Each filter that was given can list its stalls straight from an index: the keyword postings, a slice of the price index,
+# or the stalls of the canteens around the user (nearest first). The number of stalls each would list is estimated cheaply,
+# the smallest list is read and the other filters are checked on its stalls only, most selective first.
+class CombinedSearch:
+    def __init__(self, catalog, query, minPrice, maxPrice, userLocation, numOfCanteens, radius):
+        self.catalog = catalog
+        self.columns = catalog.columns
+        self.minPrice = -inf if minPrice is None else minPrice
+        self.maxPrice = inf if maxPrice is None else maxPrice
+        self.userLocation = userLocation
+        self.numOfCanteens = numOfCanteens
+        self.radius = radius
+
+        # Estimated number of stalls each filter lets through, keyed on its name
+        self.estimates = {}
+
+        # The keyword strings matching the query, and a memo of whether each keyword string of the columns is one of them
+        self.texts = None
+        if query is not None:
+            self.texts = matching_texts(query, catalog.keywordIndex)
+            self.estimates["keyword"] = sum(len(catalog.keywordIndex.textStalls[textId]) for textId in self.texts)
+            self.keywordMatches = {}
+
+        self.priceRange = None
+        if minPrice is not None or maxPrice is not None:
+            self.priceRange = catalog.priceIndex.positions(self.minPrice, self.maxPrice)
+            self.estimates["price"] = self.priceRange[1] - self.priceRange[0]
+
+        # Canteen ids (their position in catalog.canteens) break ties in distance, like the spatial index does
+        self.distances = {}
+        if userLocation is not None:
+            self.canteenIds = catalog.canteenIds
+            # The canteens the search would start with: those within radius (the numOfCanteens nearest of them), or the
+            # numOfCanteens nearest. Neither walks every canteen, so a small radius stays cheap on a big map.
+            self.nearby = None
+            if radius is not None:
+                nearby = sorted((self.distance(catalog.canteens[canteenId]), canteenId) for canteenId in catalog.spatialIndex.within(userLocation, radius))
+                self.nearby = [(canteenId, distance) for distance, canteenId in nearby]
+                nearby = self.nearby if numOfCanteens is None else self.nearby[:numOfCanteens]
+            elif numOfCanteens is not None:
+                nearby = catalog.spatialIndex.nearest(userLocation, numOfCanteens)
+            if radius is None and numOfCanteens is None:
+                # Every canteen is in range, the location only ranks the stalls
+                self.estimates["location"] = catalog.numOfStalls
+            else:
+                self.estimates["location"] = sum(len(catalog.canteenIndex.search(catalog.canteens[canteenId])) for canteenId, distance in nearby)
+
+    def keyword_matches(self, stallId):
+        keywordId = self.columns.keywordIds[stallId]
+        if keywordId not in self.keywordMatches:
+            textId = self.catalog.keywordIndex.textIds.get(self.columns.keywordTexts[keywordId].lower())
+            self.keywordMatches[keywordId] = textId in self.texts
+        return self.keywordMatches[keywordId]
+
+    def price_matches(self, stallId):
+        return self.minPrice <= self.columns.price(stallId) <= self.maxPrice
+
+    # Returns the distance from the user to a canteen
+    def distance(self, canteen):
+        if canteen not in self.distances:
+            x, y = self.userLocation
+            pointX, pointY = self.catalog.locations[canteen]
+            self.distances[canteen] = sqrt(squared_distance(x, y, pointX, pointY))
+        return self.distances[canteen]
+
+    def location_matches(self, stallId):
+        return self.radius is None or self.distance(self.columns.canteen(stallId)) <= self.radius
+
+    # Lists (canteen id, distance) of the canteens around the user, nearest first and stopping at radius.
+    # With a radius these are the canteens found within it. Without one, canteens are asked from the spatial index a few at
+    # a time, doubling each time, so far away canteens are never looked at.
+    def canteens_by_distance(self):
+        if self.nearby is not None:
+            yield from self.nearby
+            return
+        numOfCanteens = len(self.catalog.canteens)
+        batchSize = max(1, self.numOfCanteens or 1)
+        numOfSeen = 0
+        while numOfSeen < numOfCanteens:
+            nearest = self.catalog.spatialIndex.nearest(self.userLocation, min(numOfCanteens, batchSize))
+            for canteenId, distance in nearest[numOfSeen:]:
+                if self.radius is not None and distance > self.radius:
+                    return
+                yield (canteenId, distance)
+            numOfSeen = len(nearest)
+            batchSize *= 2
+
+    # Runs the search and returns its CombinedResult
+    def run(self, keyword):
+        filters = {"keyword": self.keyword_matches, "price": self.price_matches, "location": self.location_matches}
+        order = sorted(self.estimates, key=lambda name: (self.estimates[name], name))
+        start = order[0]
+        checks = [filters[name] for name in order[1:]]
+        sources = {"keyword": "keyword postings", "price": "price index", "location": "canteens nearest first"}
+        plan = ["{} ({} stalls)".format(sources[start], self.estimates[start])] + ["{} filter".format(name) for name in order[1:]]
+
+        if start == "location":
+            # Go through the canteens nearest first, until enough canteens with a matching stall were found
+            matches = []
+            numOfCanteensFound = 0
+            for canteenId, distance in self.canteens_by_distance():
+                if self.numOfCanteens is not None and numOfCanteensFound >= self.numOfCanteens:
+                    break
+                canteen = self.catalog.canteens[canteenId]
+                found = [stallId for stallId in self.catalog.canteenIndex.search(canteen) if all(check(stallId) for check in checks)]
+                numOfCanteensFound += len(found) > 0
+                self.distances[canteen] = distance
+                matches.extend(found)
+        else:
+            if start == "keyword":
+                candidates = self.catalog.keywordIndex.stalls_using(self.texts)
+            else:
+                candidates = self.catalog.priceIndex.stallIds[self.priceRange[0]:self.priceRange[1]]
+            matches = [stallId for stallId in candidates if all(check(stallId) for check in checks)]
+
+            # Keep the stalls of the numOfCanteens nearest canteens that had a match
+            if self.userLocation is not None and self.numOfCanteens is not None:
+                canteens = {self.columns.canteen(stallId) for stallId in matches}
+                nearest = set(sorted(canteens, key=lambda canteen: (self.distance(canteen), self.canteenIds[canteen]))[:self.numOfCanteens])
+                matches = [stallId for stallId in matches if self.columns.canteen(stallId) in nearest]
+
+        return CombinedResult(keyword, None if self.minPrice == -inf else self.minPrice, None if self.maxPrice == inf else self.maxPrice,
+                              self.userLocation, self.numOfCanteens, self.radius, self.ranked(matches), tuple(plan))
+
+    # Turns stall ids into RankedStall, nearest first (then cheapest, then by name) with a location, or cheapest first without
+    def ranked(self, stallIds):
+        def rank(stallId):
+            price = self.columns.price(stallId)
+            priceKey = price if price == price else inf
+            nameKey = self.catalog.stall_sort_key(stallId)
+            if self.userLocation is None:
+                return (priceKey, nameKey)
+            canteen = self.columns.canteen(stallId)
+            return (self.distance(canteen), self.canteenIds[canteen], priceKey, nameKey)
+
+        stalls = []
+        for stallId in sorted(stallIds, key=rank):
+            stall = self.catalog.stall(stallId)
+            distance = None if self.userLocation is None else self.distance(stall.canteen)
+            stalls.append(RankedStall(stall.canteen, stall.name, stall.price, stall.keywords, distance))
+        return tuple(stalls)
+
+
+# Converts a field of a query to a float, refusing infinities and NaN (they would also make the JSON results invalid)
+def finite_number(value):
+    number = float(value)
+    if not isfinite(number):
+        raise ValueError("{!r} is not a finite number".format(value))
+    return number
+
+
+# Runs a query given as a dictionary (e.g. one line of a JSONL query log) and returns its result object.
+#   {"type": "keyword", "keyword": "chicken"}  or  {"type": "keyword", "keyword": "halal AND noodles NOT spicy"}
+#   {"type": "price", "min": 3, "max": 5}
+#   {"type": "nearest", "x": 300, "y": 400, "k": 3}
+#   {"type": "walking", "x": 300, "y": 400, "k": 3}  (nearest by walking distance, needs a path graph)
+#   {"type": "combined", "keyword": "halal", "max": 5, "x": 300, "y": 400, "radius": 300}  (any mix of the fields above)
+# Raises ValueError if the query is not understood.
+@timed("run_query", query=True)
+def run_query(query, catalog=None):
+    if not isinstance(query, dict):
+        raise ValueError("A query must be a JSON object")
+    try:
+        queryType = query["type"]
+        if queryType == "keyword":
+            return query_keyword(str(query["keyword"]), catalog)
+        elif queryType == "price":
+            return query_price(finite_number(query["min"]), finite_number(query["max"]), catalog)
+        elif queryType == "nearest":
+            return query_nearest((finite_number(query["x"]), finite_number(query["y"])), int(query.get("k", 1)), catalog)
+        elif queryType == "walking":
+            result = query_walking((finite_number(query["x"]), finite_number(query["y"])), int(query.get("k", 1)), catalog)
+            if result is None:
+                raise QueryError("No path graph was given for this dataset, so walking distances are not known")
+            return result
+        elif queryType == "combined":
+            # Every field is optional, e.g. {"type": "combined", "keyword": "halal", "max": 5, "x": 300, "y": 400, "radius": 300}
+            optional = lambda name, convert: None if query.get(name) is None else convert(query[name])
+            userLocation = None if query.get("x") is None and query.get("y") is None else (finite_number(query["x"]), finite_number(query["y"]))
+            return query_combined(optional("keyword", str), optional("min", finite_number), optional("max", finite_number), userLocation,
+                                  optional("k", int), optional("radius", finite_number), catalog)
+    except KeyError as error:
+        raise ValueError("Missing field {} in {} query".format(error, query.get("type")))
+    except (QuerySyntaxError, QueryError):
+        raise
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("Invalid field value in {} query".format(query.get("type")))
+    raise ValueError("Unknown query type {!r}, expected 'keyword', 'price', 'nearest', 'walking' or 'combined'".format(queryType))
+
+
+# Converts a result object into plain dictionaries and lists, ready to be written out as JSON
+def result_as_dict(result):
+    if isinstance(result, tuple) and hasattr(result, "_fields"):
+        return {field: result_as_dict(value) for field, value in zip(result._fields, result)}
+    elif isinstance(result, (list, tuple)):
+        return [result_as_dict(value) for value in result]
+    return result
+
+
+# Turns a collection of stall ids into a list of StallMatch, ordered by canteen (in natural order) and then by stall name
+@timed("group_by_canteen")
+def group_by_canteen(catalog, stallIds):
+    count("stalls_matched", len(stallIds))
+    stallsByCanteen = {}
+    for stallId in sorted(stallIds, key=catalog.stall_sort_key):
+        stall = catalog.stall(stallId)
+        stallsByCanteen.setdefault(stall.canteen, []).append(StallMatch(stall.canteen, stall.name, stall.price, stall.keywords))
+
+    return tuple(match for canteen in natural_sort(stallsByCanteen.keys()) for match in stallsByCanteen[canteen])
+
+
+# This function sorts a list of strings/numbers no matter if a number is in a string or not
+# E.g. elm0, elm11, elm2, elm55 => elm0, elm2, elm11, elm55
+@timed("natural_sort")
+def natural_sort(unsortedList):
+    # Lambda transforms all given inputs based on the instructions given and returns it as a result
+    # convert transforms any given inputs into an integer if the input is a digit. If not, it transforms the string into lowercase.
+    convert = lambda text: int(text) if text.isdigit() else text.lower()
+    # alphanumKey splits given inputs into strings and numbers (e.g. "a23b" => ["a", "23", "b'"])
+    # It then converts each item in the list using the convert lambda above
+    alphanumKey = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ]
+    # We then sort any given list input using alphanumKey as the key for sorting
+    # Since alphanumKey is a list of letters and numbers, the sorted functions is able to compare integer > interger and string > string
+    # Therefore, it can sort numbers within strings and return a naturally sorted result.
+    return sorted(unsortedList, key = alphanumKey)
@@ -0,0 +1,667 @@
+# Search indexes built over a CanteenCatalog, so queries do not have to scan every stall
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict
+from copy import copy
+from difflib import SequenceMatcher
+from heapq import heappush, heapreplace, nsmallest
+from math import sqrt
+
+from instrumentation import timed
+
+
+# Returns the squared distance between two points as dx * dx + dy * dy, the same operations SpatialIndex.nearest() and
+# nearest_batch() use, so every path gives the same distances to the last bit
+def squared_distance(x, y, pointX, pointY):
+    differenceX, differenceY = x - pointX, y - pointY
+    return differenceX * differenceX + differenceY * differenceY
+
+
+# Returns the set of n-grams (substrings of length n) of a piece of text
+def ngrams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+# Returns container[key] ready to be changed in place, creating it with newPosting() if it is missing.
+# While an index is being patched (owned is a set), postings still shared with the previous version of the index
+# are copied the first time they are touched, so queries running on the previous version never see the change.
+def writable_posting(container, key, owned, newPosting):
+    if key not in container:
+        container[key] = newPosting()
+    elif owned is not None and key not in owned:
+        container[key] = copy(container[key])
+    else:
+        return container[key]
+    if owned is not None:
+        owned.add(key)
+    return container[key]
+
+
+# Returns an empty posting list of ids, packed 4 bytes per id
+def id_posting():
+    return array("I")
+
+
+# Returns the first position in the sorted part sequence[lo:hi] where key(item) is not less than target,
+# like bisect_left on a sequence of key(item) values that never has to be built
+def bisect_key(sequence, target, key, lo=0, hi=None):
+    hi = len(sequence) if hi is None else hi
+    while lo < hi:
+        middle = (lo + hi) // 2
+        if key(sequence[middle]) < target:
+            lo = middle + 1
+        else:
+            hi = middle
+    return lo
+
+
+# Returns the distinct keywords in a keyword string, e.g. "Chinese, Chicken, Rice" -> Chinese, Chicken, Rice
+def keyword_tokens(text):
+    return dict.fromkeys(token.strip() for token in text.split(",") if token.strip())
+
+
+# Inverted index over the keywords of every stall.
+# A stall matches a search term if the term is part of the stall's keyword string (e.g. "chick" in "chinese, chicken, rice"),
+# or if the whole keyword string is part of the search term. Both checks are made on the lowercase keyword string.
+class KeywordIndex:
+    # Substring lookups use n-grams of these sizes, shorter terms are checked against every keyword string
+    GRAM_SIZES = (2, 3)
+
+    def __init__(self, catalog):
+        # Many stalls share the same keyword string, so we index each distinct string once.
+        # texts[textId] = lowercase keyword string, textStalls[textId] = ids of the stalls using it
+        self.texts = []
+        self.textStalls = {}
+        self.textIds = {}
+
+        # n-gram -> ids of the keyword strings containing it
+        self.grams = {}
+
+        # No keyword string longer than this can be part of a search term
+        self.longestText = 0
+
+        columns = catalog.columns
+        for stallId in catalog.live_stall_ids():
+            self.add_stall(stallId, columns.keywords(stallId))
+
+    # Adds a stall (given its keyword string) to the index. Stall ids only ever grow, so appending keeps every posting sorted.
+    def add_stall(self, stallId, keywords, owned=None):
+        text = keywords.lower()
+        textId = self.textIds.get(text)
+        if textId is None:
+            textId = len(self.texts)
+            self.textIds[text] = textId
+            self.texts.append(text)
+            self.longestText = max(self.longestText, len(text))
+            for n in self.GRAM_SIZES:
+                for gram in ngrams(text, n):
+                    writable_posting(self.grams, gram, owned and owned["grams"], id_posting).append(textId)
+
+        writable_posting(self.textStalls, textId, owned and owned["textStalls"], id_posting).append(stallId)
+
+    # Removes a stall from the index. Keyword strings no stall uses any more are left in place, they simply match nothing.
+    def remove_stall(self, stallId, keywords, owned=None):
+        textId = self.textIds[keywords.lower()]
+        writable_posting(self.textStalls, textId, owned and owned["textStalls"], id_posting).remove(stallId)
+
+    # Returns a copy of the index with some stalls removed (as (id, stall) pairs) and some added (as ids in the new catalog).
+    # Only the postings touched by those stalls are copied, the rest are shared with this index, which is left unchanged.
+    def patched(self, catalog, removed, added):
+        index = copy(self)
+        index.texts = list(self.texts)
+        index.textStalls = dict(self.textStalls)
+        index.textIds = dict(self.textIds)
+        index.grams = dict(self.grams)
+        owned = {"textStalls": set(), "grams": set()}
+        for stallId, stall in removed:
+            index.remove_stall(stallId, stall.keywords, owned)
+        for stallId in added:
+            index.add_stall(stallId, catalog.columns.keywords(stallId), owned)
+        return index
+
+    # Returns the ids of the keyword strings that contain the search term
+    def texts_containing(self, searchTerm):
+        n = min(len(searchTerm), max(self.GRAM_SIZES))
+        if n not in self.GRAM_SIZES:
+            return [textId for textId, text in enumerate(self.texts) if searchTerm in text]
+
+        # Every n-gram of the term must be in the keyword string, so we intersect their postings, smallest first
+        postings = sorted((self.grams.get(gram, ()) for gram in ngrams(searchTerm, n)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+
+        # The n-grams only narrow things down (they could appear in a different order), so we confirm each candidate
+        return [textId for textId in candidates if searchTerm in self.texts[textId]]
+
+    # Returns the ids of the keyword strings that are themselves part of the search term
+    def texts_within(self, searchTerm):
+        found = []
+        for start in range(len(searchTerm)):
+            for end in range(start + 1, min(len(searchTerm), start + self.longestText) + 1):
+                textId = self.textIds.get(searchTerm[start:end])
+                if textId is not None:
+                    found.append(textId)
+        return found
+
+    # Returns the set of ids of the keyword strings matching a lowercase search term
+    def texts_matching(self, searchTerm):
+        return set(self.texts_containing(searchTerm)) | set(self.texts_within(searchTerm))
+
+    # Returns a rough estimate of the number of keyword strings matching a search term, without searching:
+    # the size of the smallest n-gram posting of the term, or every keyword string for terms too short to have n-grams
+    def estimate_texts(self, searchTerm):
+        n = min(len(searchTerm), max(self.GRAM_SIZES))
+        if n not in self.GRAM_SIZES:
+            return len(self.texts)
+        return min(len(self.grams.get(gram, ())) for gram in ngrams(searchTerm, n))
+
+    # Returns the set of ids of the stalls using any of the given keyword strings
+    def stalls_using(self, textIds):
+        stallIds = set()
+        for textId in textIds:
+            stallIds.update(self.textStalls[textId])
+        return stallIds
+
+    # Returns the set of ids of the stalls matching a lowercase search term
+    def search(self, searchTerm):
+        return self.stalls_using(self.texts_matching(searchTerm))
+
+
+# Stall prices kept in sorted order, so a price range is found with two binary searches instead of a full scan
+class PriceIndex:
+    def __init__(self, catalog):
+        # Stalls without a valid price (NaN) never fall inside a price range, so they are left out of the index.
+        # Stalls are sorted by (price, id), so stalls at the same price are in id order. Prices are kept as the catalog
+        # hands them back (see catalog.widen_price), so range ends compare exactly as they do against the stalls' prices.
+        columns = catalog.columns
+        pricedStalls = sorted((columns.price(stallId), stallId) for stallId in catalog.live_stall_ids()
+                              if columns.prices[stallId] == columns.prices[stallId])
+        self.prices = array("d", (price for price, stallId in pricedStalls))
+        self.stallIds = array("I", (stallId for price, stallId in pricedStalls))
+
+    # Returns the position of (price, stallId) in the sorted arrays
+    def position(self, price, stallId):
+        start = bisect_left(self.prices, price)
+        end = bisect_right(self.prices, price, start)
+        return bisect_left(self.stallIds, stallId, start, end)
+
+    # Returns a copy of the index with some stalls removed (as (id, stall) pairs) and some added (as ids in the new catalog).
+    # This index is left unchanged, so queries still running on it are not affected.
+    def patched(self, catalog, removed, added):
+        index = copy(self)
+        index.prices = copy(self.prices)
+        index.stallIds = copy(self.stallIds)
+        for stallId, stall in removed:
+            if stall.price == stall.price:
+                position = index.position(stall.price, stallId)
+                del index.prices[position]
+                del index.stallIds[position]
+        for stallId in added:
+            price = catalog.columns.price(stallId)
+            if price == price:
+                position = index.position(price, stallId)
+                index.prices.insert(position, price)
+                index.stallIds.insert(position, stallId)
+        return index
+
+    # Returns the ids of the stalls priced within minPrice and maxPrice (inclusive), cheapest first
+    def search(self, minPrice, maxPrice):
+        start, end = self.positions(minPrice, maxPrice)
+        return self.stallIds[start:end]
+
+    # Returns the (start, end) positions of the stalls priced within minPrice and maxPrice, so they can be counted cheaply
+    def positions(self, minPrice, maxPrice):
+        start = bisect_left(self.prices, minPrice)
+        return (start, max(start, bisect_right(self.prices, maxPrice)))
+
+
+# Ids of the stalls of each canteen, so the stalls of the canteens found by a location search are listed without a scan
+class CanteenIndex:
+    def __init__(self, catalog):
+        # canteen name -> ids of its stalls, in id order
+        self.stalls = {}
+        columns = catalog.columns
+        for stallId in catalog.live_stall_ids():
+            writable_posting(self.stalls, columns.canteen(stallId), None, id_posting).append(stallId)
+
+    # Returns a copy of the index with some stalls removed (as (id, stall) pairs) and some added (as ids in the new catalog).
+    # Only the postings touched by those stalls are copied, the rest are shared with this index, which is left unchanged.
+    def patched(self, catalog, removed, added):
+        index = copy(self)
+        index.stalls = dict(self.stalls)
+        owned = set()
+        for stallId, stall in removed:
+            writable_posting(index.stalls, stall.canteen, owned, id_posting).remove(stallId)
+        for stallId in added:
+            writable_posting(index.stalls, catalog.columns.canteen(stallId), owned, id_posting).append(stallId)
+        return index
+
+    # Returns the ids of the stalls of a canteen
+    def search(self, canteen):
+        return self.stalls.get(canteen, ())
+
+
+# Returns the coordinates as a packed array of 16-bit integers, or of wider integers if some coordinate does not fit in 16 bits,
+# or of floats if some coordinate is not a whole number
+def coordinate_array(coordinates):
+    coordinates = list(coordinates)
+    if not all(isinstance(coordinate, int) for coordinate in coordinates):
+        return array("d", coordinates)
+    if all(-0x8000 <= coordinate < 0x8000 for coordinate in coordinates):
+        return array("h", coordinates)
+    return array("q", coordinates)
+
+
+# KD-tree over the canteen locations for exact k-nearest-canteen queries.
+# Canteens are identified by their position in catalog.canteens, and ties in distance go to the canteen listed first.
+# The same tree can be built over any other list of (x, y) points (e.g. the nodes of the campus path graph) by passing points
+# instead of a catalog, ids are then positions in that list.
+class SpatialIndex:
+    def __init__(self, catalog=None, points=None):
+        if points is None:
+            self.canteens = catalog.canteens
+            points = [catalog.locations[canteen] for canteen in catalog.canteens]
+        # Canteen locations as two packed columns of x and y (16-bit unless the map is bigger than that)
+        self.pointX = coordinate_array(x for x, y in points)
+        self.pointY = coordinate_array(y for x, y in points)
+
+        # The tree is stored as parallel lists, node i splits on axis nodeAxis[i] at the point of canteen nodeCanteen[i]
+        self.nodeCanteen = []
+        self.nodeAxis = []
+        self.nodeLeft = []
+        self.nodeRight = []
+        self.root = self.build(list(range(len(self.pointX))), 0)
+
+    # Builds the subtree for a list of canteen ids and returns its node id (-1 for an empty subtree)
+    def build(self, canteenIds, depth):
+        if not canteenIds:
+            return -1
+
+        # Split on x and y in turn, at the median point
+        axis = depth % 2
+        canteenIds.sort(key=(self.pointX, self.pointY)[axis].__getitem__)
+        median = len(canteenIds) // 2
+
+        node = len(self.nodeCanteen)
+        self.nodeCanteen.append(canteenIds[median])
+        self.nodeAxis.append(axis)
+        self.nodeLeft.append(-1)
+        self.nodeRight.append(-1)
+        self.nodeLeft[node] = self.build(canteenIds[:median], depth + 1)
+        self.nodeRight[node] = self.build(canteenIds[median + 1:], depth + 1)
+        return node
+
+    # Returns the k canteens nearest to a location as a list of (canteen id, distance), nearest first
+    def nearest(self, location, k):
+        k = min(k, len(self.pointX))
+        if k <= 0:
+            return []
+        x, y = location
+
+        # Max-heap (via negated keys) of the best k candidates so far, so the worst one can be swapped out in O(log k)
+        best = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node == -1:
+                continue
+            canteenId = self.nodeCanteen[node]
+            pointX, pointY = self.pointX[canteenId], self.pointY[canteenId]
+            # squared_distance(), inlined
+            differenceX, differenceY = x - pointX, y - pointY
+            squaredDistance = differenceX * differenceX + differenceY * differenceY
+            candidate = (-squaredDistance, -canteenId)
+            if len(best) < k:
+                heappush(best, candidate)
+            elif candidate > best[0]:
+                heapreplace(best, candidate)
+
+            # Visit the side of the split containing the location last (so it is popped first),
+            # and only visit the far side if it could still hold something at least as near as our worst candidate
+            difference = (x, y)[self.nodeAxis[node]] - (pointX, pointY)[self.nodeAxis[node]]
+            near, far = (self.nodeLeft[node], self.nodeRight[node]) if difference < 0 else (self.nodeRight[node], self.nodeLeft[node])
+            if len(best) < k or difference**2 <= -best[0][0]:
+                stack.append(far)
+            stack.append(near)
+
+        return [(-negatedId, sqrt(-negatedDistance)) for negatedDistance, negatedId in sorted(best, reverse=True)]
+
+    # Returns the ids of the canteens within radius of a location (inclusive), in no particular order
+    def within(self, location, radius):
+        x, y = location
+        squaredRadius = radius**2
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node == -1:
+                continue
+            canteenId = self.nodeCanteen[node]
+            pointX, pointY = self.pointX[canteenId], self.pointY[canteenId]
+            differenceX, differenceY = x - pointX, y - pointY
+            if differenceX * differenceX + differenceY * differenceY <= squaredRadius:
+                found.append(canteenId)
+
+            # Only visit a side of the split if the circle reaches into it
+            difference = (x, y)[self.nodeAxis[node]] - (pointX, pointY)[self.nodeAxis[node]]
+            if difference <= radius:
+                stack.append(self.nodeLeft[node])
+            if difference >= -radius:
+                stack.append(self.nodeRight[node])
+        return found
+
+    # Batch version of nearest() for many locations at once, e.g. every hostel and bus stop on campus.
+    # Takes an N x 2 array of (x, y) points and returns two N x k arrays: the canteen ids and their distances, nearest first.
+    # Distances are worked out as a points x canteens matrix a chunk of points at a time, so memory stays bounded
+    # at roughly maxChunkElements floats however many points are given. Results are the same as calling nearest() per point.
+    def nearest_batch(self, points, k, maxChunkElements=1 << 22):
+        # NumPy is only needed for batch queries, so we do not make every interactive search pay for importing it
+        import numpy as np
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        canteenPoints = np.column_stack((self.pointX, self.pointY)).astype(np.float64).reshape(-1, 2)
+        numOfCanteens = len(canteenPoints)
+        k = max(0, min(k, numOfCanteens))
+        canteenIds = np.empty((len(points), k), dtype=np.int64)
+        distances = np.empty((len(points), k), dtype=np.float64)
+        if k == 0 or len(points) == 0:
+            return (canteenIds, distances)
+
+        # When every squared distance is a whole number (clicks land on pixels), squaredDistance * numOfCanteens + canteenId
+        # is an exact, unique sort key, so argpartition can pick the top k with ties going to the lower canteen id
+        largestSquaredDistance = ((np.abs(points).max() + np.abs(canteenPoints).max()) * 2)**2
+        exactKeys = bool(np.all(points == np.floor(points)) and np.all(canteenPoints == np.floor(canteenPoints))
+                         and (largestSquaredDistance + 1) * numOfCanteens < 2**53)
+
+        chunkSize = max(1, maxChunkElements // numOfCanteens)
+        canteenX, canteenY = canteenPoints[:, 0], canteenPoints[:, 1]
+        for start in range(0, len(points), chunkSize):
+            chunk = points[start:start + chunkSize]
+            # The same operations as nearest(), in the same order: dx * dx + dy * dy
+            differences = chunk[:, 0:1] - canteenX
+            squaredDistances = np.multiply(differences, differences)
+            differences = chunk[:, 1:2] - canteenY
+            squaredDistances += np.multiply(differences, differences, out=differences)
+
+            if exactKeys and k < numOfCanteens:
+                keys = squaredDistances
+                keys *= numOfCanteens
+                keys += np.arange(numOfCanteens)
+                nearest = np.argpartition(keys, k - 1, axis=1)[:, :k]
+                nearestKeys = np.take_along_axis(keys, nearest, axis=1)
+                order = np.argsort(nearestKeys, axis=1)
+                nearest = np.take_along_axis(nearest, order, axis=1)
+                # Recover the squared distances from the keys (exact, as both parts are whole numbers)
+                nearestSquaredDistances = (np.take_along_axis(nearestKeys, order, axis=1) - nearest) / numOfCanteens
+            else:
+                # A stable sort keeps canteens at equal distances in id order
+                nearest = np.argsort(squaredDistances, axis=1, kind="stable")[:, :k]
+                nearestSquaredDistances = np.take_along_axis(squaredDistances, nearest, axis=1)
+
+            canteenIds[start:start + len(chunk)] = nearest
+            distances[start:start + len(chunk)] = np.sqrt(nearestSquaredDistances)
+
+        return (canteenIds, distances)
+
+
+# Suggests known keywords that are close to a misspelt search term (e.g. "chiken" -> "Chicken").
+# Candidates are the keywords sharing the most padded trigrams with the term, and only those few are scored
+# with difflib's similarity ratio, instead of running difflib against the whole vocabulary. Suggestions are therefore
+# approximate: a keyword sharing less than half of the term's trigrams is never suggested, even if difflib rates it well.
+class SuggestionIndex:
+    # Number of candidates (per suggestion asked for) that get scored with difflib
+    CANDIDATES_PER_SUGGESTION = 32
+
+    def __init__(self, catalog):
+        # Every keyword once, in the order it first appears in the data, and the same keywords in lowercase.
+        # stallCounts[termId] is the number of stalls using the keyword, keywords no stall uses any more are not suggested.
+        self.vocabulary = []
+        self.lowercaseTerms = []
+        self.termIds = {}
+        self.stallCounts = []
+
+        # padded trigram -> ids of the keywords containing it, e.g. "chicken" is indexed under "^ch", "chi", ..., "en$"
+        self.grams = {}
+
+        # Stalls sharing a keyword string are counted together, Counter keeps the strings in the order they first appear
+        columns = catalog.columns
+        stallsPerText = Counter(columns.keywordIds[stallId] for stallId in catalog.live_stall_ids())
+        for keywordId, numOfStalls in stallsPerText.items():
+            self.add_stalls(columns.keywordTexts[keywordId], numOfStalls)
+
+    # Counts numOfStalls more stalls using a keyword string
+    def add_stalls(self, keywords, numOfStalls=1, owned=None):
+        for keyword in keyword_tokens(keywords):
+            termId = self.termIds.get(keyword)
+            if termId is None:
+                termId = len(self.vocabulary)
+                self.termIds[keyword] = termId
+                self.vocabulary.append(keyword)
+                self.lowercaseTerms.append(keyword.lower())
+                self.stallCounts.append(0)
+                for gram in padded_trigrams(keyword.lower()):
+                    writable_posting(self.grams, gram, owned, id_posting).append(termId)
+            self.stallCounts[termId] += numOfStalls
+
+    def remove_stall(self, keywords):
+        for keyword in keyword_tokens(keywords):
+            self.stallCounts[self.termIds[keyword]] -= 1
+
+    # Returns a copy of the index with some stalls removed (as (id, stall) pairs) and some added (as ids in the new catalog).
+    # This index is left unchanged, so queries still running on it are not affected.
+    def patched(self, catalog, removed, added):
+        index = copy(self)
+        index.vocabulary = list(self.vocabulary)
+        index.lowercaseTerms = list(self.lowercaseTerms)
+        index.termIds = dict(self.termIds)
+        index.stallCounts = list(self.stallCounts)
+        index.grams = dict(self.grams)
+        owned = set()
+        for stallId, stall in removed:
+            index.remove_stall(stall.keywords)
+        for stallId in added:
+            index.add_stalls(catalog.columns.keywords(stallId), 1, owned)
+        return index
+
+    # Returns every keyword used by at least one stall, in the order they first appeared
+    def keywords(self):
+        return [keyword for keyword, stallCount in zip(self.vocabulary, self.stallCounts) if stallCount > 0]
+
+    # Returns up to n keywords similar to the search term, most similar first.
+    # Only keywords with a difflib similarity ratio of at least cutoff are suggested.
+    @timed("difflib_suggest")
+    def suggest(self, searchTerm, n=1, cutoff=0.5):
+        searchTerm = searchTerm.lower()
+
+        # We only look at keywords sharing at least half of the search term's trigrams. Any such keyword must contain one of
+        # the (len(grams) - required + 1) rarest trigrams of the term, so only those posting lists are read (prefix filtering).
+        # The keywords found are then ranked by how many of all the term's trigrams they share, and the best are scored.
+        termGrams = padded_trigrams(searchTerm)
+        grams = sorted(termGrams, key=lambda gram: len(self.grams.get(gram, ())))
+        required = (len(grams) + 1) // 2
+        candidates = set()
+        for gram in grams[:len(grams) - required + 1]:
+            candidates.update(self.grams.get(gram, ()))
+        sharedGrams = {}
+        for termId in candidates:
+            if self.stallCounts[termId] > 0:
+                shared = len(termGrams & padded_trigrams(self.lowercaseTerms[termId]))
+                if shared >= required:
+                    sharedGrams[termId] = shared
+
+        best = nsmallest(n * self.CANDIDATES_PER_SUGGESTION, sharedGrams, key=lambda termId: (-sharedGrams[termId], termId))
+        scored = self.score(searchTerm, best, cutoff)
+
+        # Short terms with a transposition (e.g. "indain" for "indian") can share too few trigrams with the keyword they meant.
+        # If the trigrams found fewer than n keywords, every keyword is scored with difflib, as a plain scan would.
+        if len(scored) < n:
+            scored = self.score(searchTerm, (termId for termId, stallCount in enumerate(self.stallCounts) if stallCount > 0), cutoff)
+
+        return [self.vocabulary[termId] for negatedRatio, termId in sorted(scored)[:n]]
+
+    # Returns (-ratio, keyword id) of the given keywords whose difflib similarity ratio to the search term is at least cutoff
+    def score(self, searchTerm, termIds, cutoff):
+        matcher = SequenceMatcher()
+        matcher.set_seq2(searchTerm)
+        scored = []
+        for termId in termIds:
+            matcher.set_seq1(self.lowercaseTerms[termId])
+            # The quick ratios are upper bounds of ratio(), so they let us skip hopeless candidates cheaply
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                ratio = matcher.ratio()
+                if ratio >= cutoff:
+                    scored.append((-ratio, termId))
+        return scored
+
+
+# Returns the set of trigrams of a term padded with "^" and "$", so even two letter terms have trigrams
+def padded_trigrams(term):
+    return ngrams("^" + term + "$", 3)
+
+
+# Prefix autocomplete over every keyword, stall name and canteen name in the catalog.
+# Keywords and canteens are kept in one sorted list and stalls as ids sorted by name, so the terms starting with a prefix
+# are contiguous slices found with bisects.
+# Completions are ranked by how many stalls each term hits.
+class AutocompleteIndex:
+    KEYWORD = "keyword"
+    STALL = "stall"
+    CANTEEN = "canteen"
+
+    # Results for prefixes matching more terms than this are remembered, so short prefixes like "c" are not re-ranked every time.
+    # Only the CACHE_SIZE most recently used results are kept.
+    CACHE_ABOVE = 256
+    CACHE_SIZE = 1024
+
+    def __init__(self, catalog):
+        # Keywords and canteen names: (lowercase term, kind) -> [display name, number of stalls hit].
+        # Stalls sharing a keyword string or a canteen are counted together.
+        columns = catalog.columns
+        entries = {}
+        stallsPerText = Counter(columns.keywordIds[stallId] for stallId in catalog.live_stall_ids())
+        for keywordId, numOfStalls in stallsPerText.items():
+            for key, name in self.keyword_terms(columns.keywordTexts[keywordId]):
+                entries.setdefault(key, [name, 0])[1] += numOfStalls
+        stallsPerCanteen = Counter(columns.canteenIds[stallId] for stallId in catalog.live_stall_ids())
+        for canteenId, numOfStalls in stallsPerCanteen.items():
+            canteen = columns.canteenNames[canteenId]
+            entries.setdefault((canteen.lower(), self.CANTEEN), [canteen, 0])[1] += numOfStalls
+
+        # Parallel lists sorted by (term, kind)
+        sortedEntries = sorted(entries.items())
+        self.terms = [term for (term, kind), entry in sortedEntries]
+        self.kinds = [kind for (term, kind), entry in sortedEntries]
+        self.names = [entry[0] for key, entry in sortedEntries]
+        self.hits = [entry[1] for key, entry in sortedEntries]
+
+        # Stall names are not copied into the index, the stalls are kept as ids sorted by lowercase name instead
+        self.columns = columns
+        self.stallIds = catalog.stallOrder
+        self.cache = OrderedDict()
+        # Completions can be asked for on several threads at once (e.g. in search_server.py)
+        self.cacheLock = threading.Lock()
+
+    # Returns the ((lowercase term, kind), display name) of every keyword in a keyword string
+    def keyword_terms(self, keywords):
+        terms = {}
+        for keyword in keyword_tokens(keywords):
+            terms.setdefault((keyword.lower(), self.KEYWORD), keyword)
+        return terms.items()
+
+    # Returns the ((lowercase term, kind), display name) of every keyword and canteen term a stall counts towards
+    def stall_terms(self, stall):
+        terms = dict(self.keyword_terms(stall.keywords))
+        terms[(stall.canteen.lower(), self.CANTEEN)] = stall.canteen
+        return terms.items()
+
+    # Returns the lowercase name of a stall, the key self.stallIds is sorted on (ties in id order)
+    def stall_term(self, stallId):
+        return self.columns.name(stallId).lower()
+
+    # Returns a copy of the index with some stalls removed (as (id, stall) pairs) and some added (as ids in the new catalog).
+    # This index is left unchanged, so queries still running on it are not affected.
+    def patched(self, catalog, removed, added):
+        # Work out how the number of stalls hit changes for each term
+        changes = {}
+        for stallId, stall in removed:
+            for key, name in self.stall_terms(stall):
+                changes.setdefault(key, [name, 0])[1] -= 1
+        for stallId in added:
+            for key, name in self.stall_terms(catalog.stall(stallId)):
+                changes.setdefault(key, [name, 0])[1] += 1
+
+        index = copy(self)
+        index.terms = list(self.terms)
+        index.kinds = list(self.kinds)
+        index.names = list(self.names)
+        index.hits = list(self.hits)
+        index.columns = catalog.columns
+        index.stallIds = copy(self.stallIds)
+        index.cache = OrderedDict()
+        index.cacheLock = threading.Lock()
+        for (term, kind), (name, change) in changes.items():
+            # Find the entry for (term, kind), or where it would go. There are at most two kinds per term.
+            position = bisect_left(index.terms, term)
+            while position < len(index.terms) and index.terms[position] == term and index.kinds[position] < kind:
+                position += 1
+
+            if position < len(index.terms) and index.terms[position] == term and index.kinds[position] == kind:
+                index.hits[position] += change
+                # Nothing hits this term any more, so it is no longer offered as a completion
+                if index.hits[position] <= 0:
+                    for column in (index.terms, index.kinds, index.names, index.hits):
+                        del column[position]
+            elif change > 0:
+                for column, value in ((index.terms, term), (index.kinds, kind), (index.names, name), (index.hits, change)):
+                    column.insert(position, value)
+
+        for stallId, stall in removed:
+            del index.stallIds[bisect_key(index.stallIds, (stall.name.lower(), stallId), catalog.stall_sort_key)]
+        for stallId in added:
+            index.stallIds.insert(bisect_key(index.stallIds, catalog.stall_sort_key(stallId), catalog.stall_sort_key), stallId)
+        return index
+
+    # Returns the stall entries for self.stallIds[start:end] as (-hits, term, kind, name).
+    # Stalls whose names only differ in case make up one entry, shown under the name of the first of them.
+    def stall_entries(self, start, end):
+        entries = []
+        for stallId in self.stallIds[start:end]:
+            name = self.columns.name(stallId)
+            term = name.lower()
+            if entries and entries[-1][1] == term:
+                entries[-1][0] -= 1
+            else:
+                entries.append([-1, term, self.STALL, name])
+        return [tuple(entry) for entry in entries]
+
+    # Returns up to n completions of a prefix as (name, kind, number of stalls hit), most stalls first.
+    # kinds optionally limits the completions to some kinds of term, e.g. (AutocompleteIndex.KEYWORD,)
+    def complete(self, prefix, n=5, kinds=None):
+        prefix = prefix.lower()
+        kinds = None if kinds is None else tuple(kinds)
+        key = (prefix, n, kinds)
+        with self.cacheLock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        start = bisect_left(self.terms, prefix)
+        end = bisect_left(self.terms, prefix + "\U0010ffff", start)
+        candidates = [(-self.hits[entryId], self.terms[entryId], self.kinds[entryId], self.names[entryId])
+                      for entryId in range(start, end) if kinds is None or self.kinds[entryId] in kinds]
+        stallStart = bisect_key(self.stallIds, prefix, self.stall_term)
+        stallEnd = bisect_key(self.stallIds, prefix + "\U0010ffff", self.stall_term, stallStart)
+        if kinds is None or self.STALL in kinds:
+            candidates.extend(self.stall_entries(stallStart, stallEnd))
+        completions = [(name, kind, -negatedHits) for negatedHits, term, kind, name in nsmallest(n, candidates)]
+
+        if (end - start) + (stallEnd - stallStart) > self.CACHE_ABOVE:
+            with self.cacheLock:
+                self.cache[key] = completions
+                if len(self.cache) > self.CACHE_SIZE:
+                    self.cache.popitem(last=False)
+        return completions
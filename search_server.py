@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+from catalog import CatalogWatcher, get_catalog
+import instrumentation
+from query_engine import queryCache, result_as_dict, run_query
+
+# Local HTTP search service. The catalog and its indexes are loaded once and shared by every request,
+# so kiosks and bots do not pay for starting assignment.py on every search.
+#   GET  /keyword?keyword=chicken
+#   GET  /price?min=3&max=5
+#   GET  /nearest?x=300&y=400&k=3
+#   GET  /walking?x=300&y=400&k=3   (nearest by walking distance, if a path graph was given)
+#   GET  /combined?keyword=halal&max=5&x=300&y=400&radius=300   (any mix of the fields above, plus radius)
+#   POST /query            (body is a JSON query, same format as batch_search.py)
+#   GET  /stats            (per-endpoint request counts and latencies, query cache counters, and stage timings with --instrument)
+# python search_server.py [--port 8080] or python search_server.py --unix /tmp/canteens.sock
+
+# Endpoints that run a search, the rest are answered by the server itself
+SEARCH_ENDPOINTS = ("/keyword", "/price", "/nearest", "/walking", "/combined", "/query")
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 414: "URI Too Long",
+           431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+
+# Requests with a bigger body than this are refused
+MAX_BODY_SIZE = 1 << 16
+
+
+# Request count and latency of one endpoint. Percentiles are taken over the most recent samples only.
+class LatencyStats:
+    def __init__(self, numOfSamples=4096):
+        self.count = 0
+        self.errors = 0
+        self.totalSeconds = 0.0
+        self.maxSeconds = 0.0
+        self.samples = deque(maxlen=numOfSamples)
+        # Requests are answered on several executor threads at once
+        self.lock = threading.Lock()
+
+    def record(self, seconds, failed=False):
+        with self.lock:
+            self.count += 1
+            self.errors += failed
+            self.totalSeconds += seconds
+            self.maxSeconds = max(self.maxSeconds, seconds)
+            self.samples.append(seconds)
+
+    # Returns the stats in milliseconds, ready to be sent as JSON
+    def as_dict(self):
+        with self.lock:
+            samples = sorted(self.samples)
+            count, errors, totalSeconds, maxSeconds = self.count, self.errors, self.totalSeconds, self.maxSeconds
+        percentile = lambda fraction: samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000 if samples else 0.0
+        return {
+            "count": count,
+            "errors": errors,
+            "meanMs": totalSeconds / count * 1000 if count else 0.0,
+            "p50Ms": percentile(0.50),
+            "p90Ms": percentile(0.90),
+            "p99Ms": percentile(0.99),
+            "maxMs": maxSeconds * 1000,
+        }
+
+
+class SearchServer:
+    def __init__(self, data_location="canteens.xlsx", numOfThreads=4):
+        self.data_location = data_location
+        self.stats = {endpoint: LatencyStats() for endpoint in SEARCH_ENDPOINTS}
+        # Searches (and encoding their results) run on these threads, so a slow one does not hold up the other connections
+        self.executor = ThreadPoolExecutor(max(1, numOfThreads))
+
+        # Load the catalog and build its indexes up front, so the first requests are not slower than the rest
+        get_catalog(data_location).build_indexes()
+
+    # Answers one request, returns (status, JSON-ready body)
+    def respond(self, method, target, body):
+        url = urlsplit(target)
+        endpoint = url.path.rstrip("/") or "/"
+
+        if endpoint == "/stats":
+            response = {name: stats.as_dict() for name, stats in self.stats.items()}
+            response["cache"] = queryCache.stats()
+            if instrumentation.is_enabled():
+                response["stages"] = instrumentation.summary()
+            return (200, response)
+        if endpoint not in SEARCH_ENDPOINTS:
+            return (404, {"error": "Unknown endpoint {}".format(endpoint)})
+
+        if endpoint == "/query":
+            if method != "POST":
+                return (405, {"error": "Use POST with a JSON query as the body"})
+            try:
+                query = json.loads(body or b"null")
+            except (ValueError, RecursionError):
+                return (400, {"error": "Body is not valid JSON"})
+        else:
+            # e.g. /price?min=3&max=5 becomes the query {"type": "price", "min": "3", "max": "5"}
+            query = dict(parse_qsl(url.query))
+            query["type"] = endpoint[1:]
+
+        start = time.perf_counter()
+        try:
+            response = (200, {"result": result_as_dict(run_query(query, get_catalog(self.data_location)))})
+        except ValueError as error:
+            response = (400, {"error": str(error)})
+        except Exception as error:
+            # Anything else is a bug, but the client still gets an answer and the request is counted
+            response = (500, {"error": "Internal error: {}".format(type(error).__name__)})
+        self.stats[endpoint].record(time.perf_counter() - start, response[0] != 200)
+        return response
+
+    # Answers one request and encodes the answer, returns (status, body). Run on one of the executor's threads.
+    def answer(self, method, target, body):
+        status, response = self.respond(method, target, body)
+        return (status, encode_body(response))
+
+    # Serves the requests of one connection (keep-alive is supported) until the client closes it
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                # readline raises ValueError for a line longer than the stream's limit (64 KiB)
+                try:
+                    requestLine = await reader.readline()
+                except ValueError:
+                    await self.send(writer, 414, {"error": "Request line is too long"}, False)
+                    break
+                if not requestLine:
+                    break
+                try:
+                    method, target, version = requestLine.decode("latin-1").split()
+                except ValueError:
+                    await self.send(writer, 400, {"error": "Malformed request line"}, False)
+                    break
+
+                # Read the headers up to the blank line
+                headers = {}
+                try:
+                    while True:
+                        line = await reader.readline()
+                        if line in (b"\r\n", b"\n", b""):
+                            break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                except ValueError:
+                    await self.send(writer, 431, {"error": "Header line is too long"}, False)
+                    break
+
+                keepAlive = headers.get("connection", "").lower() != "close" and version != "HTTP/1.0"
+                try:
+                    contentLength = int(headers.get("content-length", 0))
+                except ValueError:
+                    contentLength = -1
+                if contentLength < 0 or contentLength > MAX_BODY_SIZE:
+                    await self.send(writer, 413, {"error": "Body must be at most {} bytes".format(MAX_BODY_SIZE)}, False)
+                    break
+                body = await reader.readexactly(contentLength) if contentLength else b""
+
+                status, response = await asyncio.get_running_loop().run_in_executor(self.executor, self.answer, method.upper(), target, body)
+                await self.send(writer, status, response, keepAlive)
+                if not keepAlive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    # Sends a response, given as a JSON-ready object or as an already encoded body
+    async def send(self, writer, status, response, keepAlive):
+        body = response if isinstance(response, bytes) else encode_body(response)
+        header = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+            status, REASONS[status], len(body), "keep-alive" if keepAlive else "close")
+        writer.write(header.encode("latin-1") + body)
+        await writer.drain()
+
+    # Starts listening on a TCP port (localhost by default) or on a Unix socket if unixPath is given
+    async def start(self, host="127.0.0.1", port=8080, unixPath=None):
+        if unixPath is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path=unixPath, backlog=4096)
+        return await asyncio.start_server(self.handle_connection, host, port, backlog=4096)
+
+
+def encode_body(response):
+    return json.dumps(response).encode("utf-8")
+
+
+# Logs a reload of the dataset picked up by the watcher
+def report_reload(catalog, changes):
+    print("Reloaded dataset: {} stall(s) added, {} updated, {} removed".format(*changes), flush=True)
+
+
+async def serve(data_location, host, port, unixPath, watchInterval, numOfThreads=4):
+    server = await SearchServer(data_location, numOfThreads).start(host, port, unixPath)
+    # Picks up edits to the workbook without a restart, requests in flight keep the catalog they started with
+    if watchInterval > 0:
+        CatalogWatcher(data_location, watchInterval, report_reload).start()
+    print("Serving canteen search on {}".format(unixPath or "http://{}:{}".format(host, port)))
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve canteen keyword, price and nearest-canteen search over local HTTP.")
+    parser.add_argument("--data", default="canteens.xlsx", help="canteen dataset to search (default: canteens.xlsx)")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument("--unix", default=None, help="listen on this Unix socket path instead of a TCP port")
+    parser.add_argument("--watch", type=float, default=1.0, help="seconds between checks of the dataset for changes, 0 to never reload (default: 1)")
+    parser.add_argument("--threads", type=int, default=4, help="number of threads searches run on (default: 4)")
+    parser.add_argument("--instrument", default=None, help="write the time of every stage of every query as JSON lines to this file (- for stderr)")
+    arguments = parser.parse_args(argv)
+    if arguments.instrument is not None:
+        instrumentation.enable(arguments.instrument)
+    try:
+        asyncio.run(serve(arguments.data, arguments.host, arguments.port, arguments.unix, arguments.watch, arguments.threads))
+    except KeyboardInterrupt:
+        print("Server stopped.")
+
+
+if __name__ == "__main__":
+    main()